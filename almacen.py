@@ -0,0 +1,203 @@
+import os
+import json
+import argparse
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+
+# flock solo existe en sistemas tipo Unix; en Windows las escrituras no se bloquean entre procesos
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Archivo con el esquema de cada dataset: columnas, tipo, cantidad de filas y bytes de id.txt confirmados
+SCHEMA_FILE = 'schema.json'
+SCHEMA_VERSION = 1
+
+# Tipo de las características y de la etiqueta
+FEATURE_DTYPE = np.float32
+CATEGORY_DTYPE = np.int8
+
+ID_FILE = 'id.txt'
+CATEGORY_FILE = 'category.i1'
+LOCK_FILE = '.lock'
+
+def column_file(store_dir, column_idx):
+    return os.path.join(store_dir, f'col_{column_idx:03d}.f32')
+
+def is_store(path):
+    return os.path.isfile(os.path.join(path, SCHEMA_FILE))
+
+def read_schema(store_dir):
+    with open(os.path.join(store_dir, SCHEMA_FILE)) as file:
+        schema = json.load(file)
+    if schema.get('version') != SCHEMA_VERSION:
+        raise ValueError(f'Versión de almacén no soportada en {store_dir}: {schema.get("version")}')
+    return schema
+
+def write_schema(store_dir, columns, n_rows, ids_bytes):
+    # El esquema se escribe al final y de forma atómica: es lo que confirma las filas agregadas
+    schema = {'version': SCHEMA_VERSION, 'dtype': np.dtype(FEATURE_DTYPE).name,
+              'n_rows': int(n_rows), 'ids_bytes': int(ids_bytes), 'columns': list(columns)}
+    tmp_path = os.path.join(store_dir, f'{SCHEMA_FILE}.{os.getpid()}.tmp')
+    with open(tmp_path, 'w') as file:
+        json.dump(schema, file, indent=2)
+    os.replace(tmp_path, os.path.join(store_dir, SCHEMA_FILE))
+
+def read_ids(store_dir, n_rows=None):
+    """Ids de las filas confirmadas del dataset."""
+    schema = read_schema(store_dir)
+    if n_rows is None:
+        n_rows = schema['n_rows']
+    # Los almacenes anteriores a ids_bytes se leen completos
+    with open(os.path.join(store_dir, ID_FILE), 'rb') as file:
+        ids = file.read(schema.get('ids_bytes', -1)).decode().splitlines()
+    return ids[:n_rows]
+
+@contextmanager
+def store_lock(store_dir):
+    """Lock exclusivo del dataset entre procesos, mientras dura una escritura (sin efecto sin fcntl)."""
+    os.makedirs(store_dir, exist_ok=True)
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(store_dir, LOCK_FILE), 'a') as file:
+        fcntl.flock(file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(file, fcntl.LOCK_UN)
+
+def append_bytes(path, data, size):
+    """Agrega bytes a un archivo, descartando antes lo que quedó sin confirmar de una escritura cortada."""
+    with open(path, 'ab') as file:
+        file.truncate(size)
+        file.write(data)
+
+def append_raw(path, values, n_rows):
+    append_bytes(path, np.ascontiguousarray(values).tobytes(), n_rows * values.dtype.itemsize)
+
+def write_store(df, store_dir, append=False):
+    """Guarda un dataframe con id, características y category en formato columnar.
+
+    Cada característica va en un archivo float32 propio, así se puede leer solo un subconjunto
+    de columnas. Con append=True las filas se agregan al final si las columnas coinciden.
+    Toma un lock del dataset, así el bot y extraccion.py pueden escribir en el mismo almacén, y
+    al agregar descarta las filas cuyo id ya está confirmado. Devuelve la cantidad de filas escritas.
+    """
+    with store_lock(store_dir):
+        columns = [column for column in df.columns if column not in ('id', 'category')]
+
+        n_rows = ids_bytes = 0
+        if append and is_store(store_dir):
+            schema = read_schema(store_dir)
+            if schema['columns'] != columns:
+                raise ValueError(f'Las columnas no coinciden con las de {store_dir}')
+            n_rows = schema['n_rows']
+            confirmados = read_ids(store_dir, n_rows)
+            ids_bytes = schema.get('ids_bytes')
+            if ids_bytes is None:
+                # Almacén anterior a ids_bytes: se mide una vez a partir de los ids confirmados
+                ids_bytes = sum(len(f'{id_}\n'.encode()) for id_ in confirmados)
+
+            # Otro proceso pudo haber agregado las mismas grabaciones desde que se leyeron sus ids
+            df = df[~df['id'].astype(str).isin(set(confirmados))]
+            if df.empty:
+                return 0
+        else:
+            for file_name in os.listdir(store_dir):
+                if file_name.endswith('.f32') or file_name in (ID_FILE, CATEGORY_FILE, SCHEMA_FILE):
+                    os.remove(os.path.join(store_dir, file_name))
+            write_schema(store_dir, columns, 0, 0)
+
+        for column_idx, column in enumerate(columns):
+            append_raw(column_file(store_dir, column_idx), df[column].to_numpy(dtype=FEATURE_DTYPE), n_rows)
+        append_raw(os.path.join(store_dir, CATEGORY_FILE), df['category'].to_numpy(dtype=CATEGORY_DTYPE), n_rows)
+
+        # Los ids también se agregan al final; el esquema guarda hasta qué byte están confirmados
+        nuevos_ids = ''.join(f'{id_}\n' for id_ in df['id']).encode()
+        append_bytes(os.path.join(store_dir, ID_FILE), nuevos_ids, ids_bytes)
+
+        write_schema(store_dir, columns, n_rows + len(df), ids_bytes + len(nuevos_ids))
+    return len(df)
+
+def read_store(store_dir, columns=None):
+    """Dataframe con id, las columnas pedidas (todas si columns es None) y category.
+
+    Solo se leen del disco los archivos de las columnas pedidas.
+    """
+    schema = read_schema(store_dir)
+    n_rows = schema['n_rows']
+    indices = {column: column_idx for column_idx, column in enumerate(schema['columns'])}
+    if columns is None:
+        columns = schema['columns']
+    faltantes = [column for column in columns if column not in indices]
+    if faltantes:
+        raise KeyError(f'Columnas inexistentes en {store_dir}: {faltantes}')
+
+    datos = {'id': read_ids(store_dir, n_rows)}
+    for column in columns:
+        datos[column] = np.fromfile(column_file(store_dir, indices[column]), dtype=FEATURE_DTYPE, count=n_rows)
+    datos['category'] = np.fromfile(os.path.join(store_dir, CATEGORY_FILE), dtype=CATEGORY_DTYPE, count=n_rows)
+    return pd.DataFrame(datos)
+
+def read_store_chunks(store_dir, chunksize, columns=None):
+    """Genera dataframes de a lo sumo chunksize filas, sin cargar el dataset completo en memoria.
+
+    Las columnas se abren como memmap, así que solo se leen del disco las filas de cada bloque.
+    """
+    schema = read_schema(store_dir)
+    n_rows = schema['n_rows']
+    indices = {column: column_idx for column_idx, column in enumerate(schema['columns'])}
+    if columns is None:
+        columns = schema['columns']
+    if n_rows == 0:
+        return
+
+    ids = read_ids(store_dir, n_rows)
+    mapas = {column: np.memmap(column_file(store_dir, indices[column]), dtype=FEATURE_DTYPE, mode='r', shape=(n_rows,))
+             for column in columns}
+    categorias = np.memmap(os.path.join(store_dir, CATEGORY_FILE), dtype=CATEGORY_DTYPE, mode='r', shape=(n_rows,))
+
+    for inicio in range(0, n_rows, chunksize):
+        fin = min(inicio + chunksize, n_rows)
+        datos = {'id': ids[inicio:fin]}
+        for column in columns:
+            datos[column] = np.array(mapas[column][inicio:fin])
+        datos['category'] = np.array(categorias[inicio:fin])
+        yield pd.DataFrame(datos)
+
+def convert_csv_dir(csv_dir, output_dir):
+    """Convierte cada CSV de una carpeta en un dataset columnar con el mismo nombre.
+
+    Lanza ValueError antes de escribir nada si algún CSV no tiene las columnas id y category
+    (los CSV de versiones anteriores de extraccion.py no tenían id y hay que regenerarlos).
+    """
+    file_names = [file_name for file_name in sorted(os.listdir(csv_dir)) if file_name.endswith('.csv')]
+    for file_name in file_names:
+        encabezado = pd.read_csv(os.path.join(csv_dir, file_name), nrows=0).columns
+        faltantes = [column for column in ('id', 'category') if column not in encabezado]
+        if faltantes:
+            raise ValueError(f'{file_name} no tiene las columnas {faltantes}; regenéralo con '
+                             f'python extraccion.py --formato csv (o directamente en formato columnar)')
+
+    for file_name in file_names:
+        df = pd.read_csv(os.path.join(csv_dir, file_name), dtype={'id': str})
+        store_dir = os.path.join(output_dir, file_name[:-len('.csv')])
+        write_store(df, store_dir)
+        print(f'{file_name}: {len(df)} filas, {len(df.columns) - 2} columnas -> {store_dir}')
+
+def main():
+    parser = argparse.ArgumentParser(description='Convierte una carpeta de CSV de características al formato columnar.')
+    parser.add_argument('csv_dir', help='Carpeta con los CSV (por ejemplo ./csv o ./dataframes_con_medias).')
+    parser.add_argument('output_dir', help='Carpeta de salida, con un dataset por CSV.')
+    args = parser.parse_args()
+
+    try:
+        convert_csv_dir(args.csv_dir, args.output_dir)
+    except ValueError as e:
+        parser.error(str(e))
+
+if __name__ == "__main__":
+    main()
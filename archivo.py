@@ -0,0 +1,275 @@
+"""Archivo compacto de audios: contenedor por bloques de solo agregado, con manifiesto e índice.
+
+Cada audio se guarda comprimido (la nota de voz OGG/Opus original o FLAC) uno detrás de otro
+en archivos chunk_NNNNN.bin de hasta CHUNK_BYTES bytes. manifest.jsonl tiene una línea por
+audio con usuario, consigna, sexo, fumador, duración, frecuencia de muestreo, formato, bloque,
+offset y longitud, así cualquier audio se lee y decodifica sin recorrer el resto. Si un mismo
+usuario y consigna aparece más de una vez, vale la última entrada.
+"""
+import io
+import os
+import re
+import json
+import argparse
+import threading
+from contextlib import contextmanager
+
+# flock solo existe en sistemas tipo Unix; en Windows el lock es solo entre hilos del mismo proceso
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+MANIFEST_FILE = 'manifest.jsonl'
+LOCK_FILE = '.lock'
+CHUNK_PATTERN = re.compile(r'^chunk_(\d+)\.bin$')
+
+# Tamaño máximo de cada bloque; al superarlo se empieza uno nuevo
+CHUNK_BYTES = 256 << 20
+
+# Carpetas de la recopilación: {Sexo}_{Fumador}/audio_{i}/{usuario}.wav
+GROUPS = {
+    'Hombre_Fuma': ('hombre', 'si'),
+    'Hombre_No_Fuma': ('hombre', 'no'),
+    'Mujer_Fuma': ('mujer', 'si'),
+    'Mujer_No_Fuma': ('mujer', 'no'),
+}
+N_PROMPTS = 6
+
+def chunk_file(archive_dir, chunk):
+    return os.path.join(archive_dir, f'chunk_{chunk:05d}.bin')
+
+def group_folder(sex, smoker):
+    return next(folder for folder, valores in GROUPS.items() if valores == (sex, smoker))
+
+def audio_info(data):
+    """Duración en segundos y frecuencia de muestreo de un audio en memoria."""
+    import soundfile as sf
+
+    info = sf.info(io.BytesIO(data))
+    return info.frames / info.samplerate, info.samplerate
+
+class Archivo:
+    """Contenedor de audios abierto para agregar y leer.
+
+    Se puede usar desde varios hilos y desde varios procesos a la vez (por ejemplo, el bot
+    archivando y archivo.py empaquetando): cada escritura toma un flock sobre la carpeta.
+    """
+
+    def __init__(self, archive_dir, chunk_bytes=CHUNK_BYTES):
+        self.archive_dir = archive_dir
+        self.chunk_bytes = chunk_bytes
+        self.lock = threading.Lock()
+        self.index = {}
+        self.chunk = 0
+        self.manifest_size = 0
+        os.makedirs(archive_dir, exist_ok=True)
+        self.manifest_path = os.path.join(archive_dir, MANIFEST_FILE)
+        self.lock_path = os.path.join(archive_dir, LOCK_FILE)
+        with self.locked():
+            self.load_manifest()
+
+    @contextmanager
+    def locked(self):
+        """Lock exclusivo entre hilos y, si hay fcntl, entre procesos."""
+        if fcntl is None:
+            with self.lock:
+                yield
+            return
+
+        with self.lock, open(self.lock_path, 'a') as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
+
+    def load_manifest(self):
+        """Carga el índice y descarta lo que haya quedado a medio escribir de una corrida interrumpida.
+
+        Se llama con el lock tomado.
+        """
+        if not os.path.exists(self.manifest_path):
+            open(self.manifest_path, 'wb').close()
+
+        with open(self.manifest_path, 'rb') as file:
+            contenido = file.read()
+
+        # Una última línea sin salto de línea es una escritura cortada
+        completo = contenido[:contenido.rfind(b'\n') + 1]
+        if len(completo) != len(contenido):
+            with open(self.manifest_path, 'r+b') as file:
+                file.truncate(len(completo))
+
+        self.index = {}
+        self.manifest_size = len(completo)
+        fin_por_bloque = {}
+        for line in completo.decode().splitlines():
+            entrada = json.loads(line)
+            self.index[(entrada['user'], entrada['prompt'])] = entrada
+            fin = entrada['offset'] + entrada['length']
+            fin_por_bloque[entrada['chunk']] = max(fin_por_bloque.get(entrada['chunk'], 0), fin)
+
+        # Los bytes que no llegaron al manifiesto no pertenecen a ningún audio: se recorta el último
+        # bloque y se borran los bloques posteriores, que quedan si se cortó justo al cambiar de bloque
+        self.chunk = max(fin_por_bloque, default=0)
+        path = chunk_file(self.archive_dir, self.chunk)
+        with open(path, 'ab') as file:
+            file.truncate(fin_por_bloque.get(self.chunk, 0))
+        for file_name in os.listdir(self.archive_dir):
+            match = CHUNK_PATTERN.match(file_name)
+            if match and int(match.group(1)) > self.chunk:
+                os.remove(os.path.join(self.archive_dir, file_name))
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def entries(self):
+        """Entradas vigentes (la última de cada usuario y consigna), en orden de usuario y consigna."""
+        return [self.index[key] for key in sorted(self.index)]
+
+    def add(self, data, user, prompt, sex, smoker, fmt):
+        """Agrega un audio ya codificado (fmt: 'ogg' o 'flac') y devuelve su entrada del manifiesto."""
+        duration, sample_rate = audio_info(data)
+        with self.locked():
+            # Si otro proceso agregó audios desde la última lectura, se vuelve a cargar el manifiesto
+            if os.path.getsize(self.manifest_path) != self.manifest_size:
+                self.load_manifest()
+
+            path = chunk_file(self.archive_dir, self.chunk)
+            offset = os.path.getsize(path)
+            if offset and offset + len(data) > self.chunk_bytes:
+                self.chunk += 1
+                path = chunk_file(self.archive_dir, self.chunk)
+                # El offset es el tamaño real del bloque nuevo, así coincide con donde escribe 'ab'
+                offset = os.path.getsize(path) if os.path.exists(path) else 0
+
+            # Primero los datos y después la línea del manifiesto, que es lo que los confirma
+            with open(path, 'ab') as file:
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+
+            entrada = {'user': user, 'prompt': int(prompt), 'sex': sex, 'smoker': smoker,
+                       'duration': round(duration, 3), 'sample_rate': int(sample_rate), 'format': fmt,
+                       'chunk': self.chunk, 'offset': offset, 'length': len(data)}
+            linea = (json.dumps(entrada, ensure_ascii=False) + '\n').encode()
+            with open(self.manifest_path, 'ab') as file:
+                file.write(linea)
+                file.flush()
+                os.fsync(file.fileno())
+            self.manifest_size += len(linea)
+
+            self.index[(user, entrada['prompt'])] = entrada
+        return entrada
+
+    def read_bytes(self, user, prompt):
+        """Bytes codificados de un audio, leídos directamente de su posición en el bloque."""
+        entrada = self.index[(user, int(prompt))]
+        with open(chunk_file(self.archive_dir, entrada['chunk']), 'rb') as file:
+            return os.pread(file.fileno(), entrada['length'], entrada['offset'])
+
+    def decode(self, user, prompt):
+        """Audio mono en [-1, 1] y su frecuencia de muestreo original."""
+        import soundfile as sf
+
+        samples, sample_rate = sf.read(io.BytesIO(self.read_bytes(user, prompt)), dtype='float64', always_2d=True)
+        return samples.mean(axis=1), sample_rate
+
+def encode_flac(wav_path):
+    """Bytes FLAC (sin pérdida, 16 bits) de un WAV."""
+    import soundfile as sf
+
+    samples, sample_rate = sf.read(wav_path, dtype='int16')
+    buffer = io.BytesIO()
+    sf.write(buffer, samples, sample_rate, format='FLAC', subtype='PCM_16')
+    return buffer.getvalue()
+
+def find_wavs(root_dir):
+    """Lista de (usuario, consigna, sexo, fumador, ruta) de los WAV del árbol de la recopilación."""
+    grabaciones = []
+    for folder, (sex, smoker) in GROUPS.items():
+        for prompt in range(1, N_PROMPTS + 1):
+            audio_dir = os.path.join(root_dir, folder, f'audio_{prompt}')
+            if not os.path.isdir(audio_dir):
+                continue
+            for file_name in sorted(os.listdir(audio_dir)):
+                if file_name.lower().endswith('.wav'):
+                    grabaciones.append((os.path.splitext(file_name)[0], prompt, sex, smoker,
+                                        os.path.join(audio_dir, file_name)))
+    return grabaciones
+
+def pack_wav_tree(root_dir, archive_dir, delete_wav=False):
+    """Agrega al archivo, como FLAC, los WAV que todavía no estén; opcionalmente borra los WAV archivados.
+
+    Con delete_wav también se borran los WAV de audios que ya estaban en el archivo (p. ej. los
+    que el bot archivó como Opus), así el árbol de WAV no ocupa espacio de más.
+    """
+    archivo = Archivo(archive_dir)
+    agregados = borrados = bytes_wav = bytes_flac = 0
+    for user, prompt, sex, smoker, wav_path in find_wavs(root_dir):
+        if (user, prompt) in archivo:
+            if delete_wav:
+                os.remove(wav_path)
+                borrados += 1
+            continue
+
+        data = encode_flac(wav_path)
+        archivo.add(data, user, prompt, sex, smoker, 'flac')
+        agregados += 1
+        bytes_wav += os.path.getsize(wav_path)
+        bytes_flac += len(data)
+
+        if delete_wav:
+            os.remove(wav_path)
+            borrados += 1
+
+    print(f'{agregados} audios agregados a {archive_dir} ({len(archivo)} en total).')
+    if agregados:
+        print(f'WAV: {bytes_wav / 1e6:.1f} MB -> FLAC: {bytes_flac / 1e6:.1f} MB ({bytes_wav / bytes_flac:.1f}x)')
+    if delete_wav:
+        print(f'{borrados} WAV borrados.')
+    return archivo
+
+def extract_tree(archive_dir, output_dir):
+    """Escribe los audios del archivo como WAV en el árbol {Sexo}_{Fumador}/audio_{i}/{usuario}.wav."""
+    import soundfile as sf
+
+    archivo = Archivo(archive_dir)
+    for entrada in archivo.entries():
+        audio_dir = os.path.join(output_dir, group_folder(entrada['sex'], entrada['smoker']), f"audio_{entrada['prompt']}")
+        os.makedirs(audio_dir, exist_ok=True)
+        samples, sample_rate = archivo.decode(entrada['user'], entrada['prompt'])
+        sf.write(os.path.join(audio_dir, f"{entrada['user']}.wav"), samples, sample_rate, subtype='PCM_16')
+    print(f'{len(archivo)} audios escritos en {output_dir}.')
+
+def main():
+    parser = argparse.ArgumentParser(description='Archivo compacto de los audios de la recopilación.')
+    subparsers = parser.add_subparsers(dest='comando', required=True)
+
+    empaquetar = subparsers.add_parser('empaquetar', help='Agrega como FLAC los WAV de un árbol de la recopilación.')
+    empaquetar.add_argument('root_dir', help='Carpeta con Hombre_Fuma, Mujer_No_Fuma, ...')
+    empaquetar.add_argument('archive_dir', help='Carpeta del archivo.')
+    empaquetar.add_argument('--borrar-wav', action='store_true', help='Borra cada WAV archivado, incluidos los que ya estaban en el archivo.')
+
+    listar = subparsers.add_parser('listar', help='Muestra el manifiesto vigente.')
+    listar.add_argument('archive_dir')
+
+    extraer = subparsers.add_parser('extraer', help='Escribe los audios archivados como árbol de WAV.')
+    extraer.add_argument('archive_dir')
+    extraer.add_argument('output_dir')
+
+    args = parser.parse_args()
+    if args.comando == 'empaquetar':
+        pack_wav_tree(args.root_dir, args.archive_dir, delete_wav=args.borrar_wav)
+    elif args.comando == 'listar':
+        for entrada in Archivo(args.archive_dir).entries():
+            print(json.dumps(entrada, ensure_ascii=False))
+    else:
+        extract_tree(args.archive_dir, args.output_dir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import numpy as np
+import parselmouth
+from parselmouth.praat import call
+
+from caracteristicas import (EXTRACTION_PARAMS, FEATURE_COLUMNS, decode_voice, extract_estimators_from_audio,
+                             extract_features, measure_feats)
+from inferencia import ARCHIVO_PIPELINES, CARPETA_MODELOS, N_MODELOS, load_pipelines, predict_proba
+
+# Casos por defecto: tipo de señal, duración en segundos y frecuencia de muestreo
+SIGNALS = ('vocal', 'conteo')
+DURATIONS = (1.0, 3.0, 10.0)
+SAMPLE_RATES = (16000, 48000)
+
+# Versión del formato del JSON de resultados
+RESULTS_VERSION = 1
+
+def synth_vowel(f0, duration, sampling_rate, seed=0):
+    """Vocal sostenida sintética: serie armónica con vibrato leve y algo de ruido, en int16."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(duration * sampling_rate)) / sampling_rate
+    fase = 2 * np.pi * f0 * (t + 0.003 / (2 * np.pi * 5) * np.sin(2 * np.pi * 5 * t))
+    x = sum(np.sin(k * fase) / k for k in range(1, 10))
+    x = 0.3 * x / np.abs(x).max() + 0.003 * rng.standard_normal(len(t))
+    return (x * 32767).astype(np.int16)
+
+def synth_counting(f0, duration, sampling_rate, seed=0):
+    """Señal parecida a contar en voz alta: sílabas sonoras de ~0.35 s con entonación descendente y pausas, en int16."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(duration * sampling_rate)) / sampling_rate
+    periodo = 0.6
+    posicion = t % periodo
+    silaba = posicion < 0.35
+
+    # Cada sílaba baja de 1.15 f0 a 0.9 f0 y tiene una envolvente suave
+    f0_instantanea = f0 * (1.15 - 0.25 * np.clip(posicion / 0.35, 0, 1))
+    fase = 2 * np.pi * np.cumsum(f0_instantanea) / sampling_rate
+    envolvente = np.where(silaba, np.sin(np.pi * np.clip(posicion / 0.35, 0, 1)) ** 0.5, 0.0)
+    x = envolvente * sum(np.sin(k * fase) / k for k in range(1, 10))
+    x = 0.3 * x / np.abs(x).max() + 0.003 * rng.standard_normal(len(t))
+    return (x * 32767).astype(np.int16)
+
+def measure_feats_calls(voiceID, f0min=75, f0max=500, unit="Hertz"):
+    """Implementación anterior de measure_feats (una llamada a Praat por medida), como referencia."""
+    sound = voiceID if isinstance(voiceID, parselmouth.Sound) else parselmouth.Sound(voiceID)
+
+    pitch = call(sound, "To Pitch", 0.0, f0min, f0max)
+    meanF0 = call(pitch, "Get mean", 0, 0, unit)
+    stdevF0 = call(pitch, "Get standard deviation", 0 ,0, unit)
+
+    intensity = call(sound, "To Intensity", 75, 0.0)
+    meanI = call(intensity, "Get mean", 0, 0)
+    stdevI = call(intensity, "Get standard deviation", 0 ,0)
+
+    harmonicity = call(sound, "To Harmonicity (cc)", 0.01, 75, 0.1, 1.0)
+    hnr = call(harmonicity, "Get mean", 0, 0)
+
+    pointProcess = call(sound, "To PointProcess (periodic, cc)", f0min, f0max)
+    localJitter = call(pointProcess, "Get jitter (local)", 0, 0, 0.0001, 0.02, 1.3)
+    localabsoluteJitter = call(pointProcess, "Get jitter (local, absolute)", 0, 0, 0.0001, 0.02, 1.3)
+    rapJitter = call(pointProcess, "Get jitter (rap)", 0, 0, 0.0001, 0.02, 1.3)
+    ppq5Jitter = call(pointProcess, "Get jitter (ppq5)", 0, 0, 0.0001, 0.02, 1.3)
+    localShimmer =  call([sound, pointProcess], "Get shimmer (local)", 0, 0, 0.0001, 0.02, 1.3, 1.6)
+    localdbShimmer = call([sound, pointProcess], "Get shimmer (local_dB)", 0, 0, 0.0001, 0.02, 1.3, 1.6)
+    apq3Shimmer = call([sound, pointProcess], "Get shimmer (apq3)", 0, 0, 0.0001, 0.02, 1.3, 1.6)
+    aqpq5Shimmer = call([sound, pointProcess], "Get shimmer (apq5)", 0, 0, 0.0001, 0.02, 1.3, 1.6)
+    apq11Shimmer =  call([sound, pointProcess], "Get shimmer (apq11)", 0, 0, 0.0001, 0.02, 1.3, 1.6)
+
+    features = meanF0, stdevF0, meanI,stdevI, hnr, localJitter, localabsoluteJitter, rapJitter, ppq5Jitter, localShimmer, localdbShimmer, apq3Shimmer, aqpq5Shimmer, apq11Shimmer
+    return np.array(features, dtype=float)
+
+def time_per_clip(func, repeats):
+    """Tiempos por ejecución, en segundos (la primera ejecución se descarta como calentamiento)."""
+    func()
+    tiempos = []
+    for _ in range(repeats):
+        inicio = time.perf_counter()
+        func()
+        tiempos.append(time.perf_counter() - inicio)
+    return np.array(tiempos)
+
+def summarize(tiempos):
+    """Estadísticos de los tiempos, en milisegundos."""
+    ms = tiempos * 1000
+    return {'median_ms': float(np.median(ms)), 'min_ms': float(ms.min()), 'mean_ms': float(ms.mean()),
+            'p90_ms': float(np.percentile(ms, 90)), 'repeats': int(len(ms))}
+
+def encode_voice(samples, sampling_rate):
+    """Bytes OGG/Opus como los de una nota de voz de Telegram (Opus solo admite algunas frecuencias)."""
+    import soundfile as sf
+
+    buffer = io.BytesIO()
+    sf.write(buffer, samples, sampling_rate, format='OGG', subtype='OPUS')
+    return buffer.getvalue()
+
+def decode_voice_pydub(data, target_sr=48000):
+    """Conversión anterior OGG -> WAV con pydub y ffmpeg, como referencia."""
+    from pydub import AudioSegment
+
+    segmento = AudioSegment.from_file(io.BytesIO(data), format='ogg').set_channels(1).set_frame_rate(target_sr)
+    samples = np.array(segmento.get_array_of_samples(), dtype=np.float64) / (1 << (8 * segmento.sample_width - 1))
+    return samples, target_sr
+
+def synthetic_pipelines(carpeta, seed=0):
+    """Escribe pipelines aleatorios con la forma de los reales, para medir el scoring sin modelos entrenados."""
+    rng = np.random.default_rng(seed)
+    np.savez(os.path.join(carpeta, ARCHIVO_PIPELINES),
+             coef=rng.standard_normal((N_MODELOS, len(FEATURE_COLUMNS))) * 1e-3,
+             intercept=np.zeros(N_MODELOS),
+             columns=np.array(FEATURE_COLUMNS, dtype=str))
+
+def run_case(signal, duration, sampling_rate, f0, repeats, carpeta, params=EXTRACTION_PARAMS):
+    """Tiempos de cada etapa para un audio sintético; las etapas que no se pueden medir quedan con su error."""
+    synth = synth_vowel if signal == 'vocal' else synth_counting
+    samples_int16 = synth(f0, duration, sampling_rate)
+    samples = samples_int16 / 32768.0
+    sound = parselmouth.Sound(samples, sampling_frequency=sampling_rate)
+
+    anterior = measure_feats_calls(sound, params['f0min'], params['f0max'], params['unit'])
+    actual = measure_feats(sound, params['f0min'], params['f0max'], params['unit'])
+    if not np.allclose(anterior, actual, equal_nan=True):
+        raise SystemExit(f'Las medidas de Praat no coinciden:\n{anterior}\n{actual}')
+
+    features = extract_features(samples, sampling_rate, params)
+    etapas = {
+            'praat': lambda: measure_feats(sound, params['f0min'], params['f0max'], params['unit']),
+            'praat_llamadas': lambda: measure_feats_calls(sound, params['f0min'], params['f0max'], params['unit']),
+            'pyaudioanalysis': lambda: extract_estimators_from_audio(samples, sampling_rate, params['stats'],
+                                                                     params['window'], params['step']),
+            'features': lambda: extract_features(samples, sampling_rate, params),
+            'scoring': lambda: predict_proba(features, 0, carpeta),
+            }
+
+    # La decodificación y el camino completo parten de la nota de voz codificada, como en el bot
+    try:
+        voz = encode_voice(samples, sampling_rate)
+    except Exception as e:
+        voz = None
+        errores = {etapa: f'no se pudo codificar en Opus: {e}' for etapa in ('decode', 'decode_pydub', 'end_to_end')}
+    else:
+        errores = {}
+        etapas['decode'] = lambda: decode_voice(voz)
+        etapas['decode_pydub'] = lambda: decode_voice_pydub(voz)
+        etapas['end_to_end'] = lambda: predict_proba(extract_features(*decode_voice(voz), params), 0, carpeta)
+
+    resultados = {}
+    for etapa, func in etapas.items():
+        try:
+            resultados[etapa] = summarize(time_per_clip(func, repeats))
+        except Exception as e:
+            resultados[etapa] = {'error': str(e)}
+    resultados.update({etapa: {'error': error} for etapa, error in errores.items()})
+
+    return {'signal': signal, 'duration_s': duration, 'sample_rate': sampling_rate, 'f0': f0,
+            'ogg_bytes': len(voz) if voz is not None else None, 'stages': resultados}
+
+def environment():
+    import scipy
+    import sklearn
+
+    return {'python': sys.version.split()[0], 'platform': platform.platform(), 'cpu_count': os.cpu_count(),
+            'numpy': np.__version__, 'scipy': scipy.__version__, 'scikit-learn': sklearn.__version__,
+            'parselmouth': parselmouth.__version__, 'praat': parselmouth.PRAAT_VERSION}
+
+def compare(resultados, baseline, tolerance):
+    """Lista de etapas cuya mediana empeoró más que tolerance (fracción) respecto de baseline."""
+    referencia = {(caso['signal'], caso['duration_s'], caso['sample_rate']): caso['stages'] for caso in baseline['cases']}
+    regresiones = []
+    for caso in resultados['cases']:
+        etapas_base = referencia.get((caso['signal'], caso['duration_s'], caso['sample_rate']), {})
+        for etapa, medida in caso['stages'].items():
+            base = etapas_base.get(etapa, {})
+            if 'median_ms' in medida and 'median_ms' in base and medida['median_ms'] > base['median_ms'] * (1 + tolerance):
+                regresiones.append(f"{caso['signal']} {caso['duration_s']:g} s {caso['sample_rate']} Hz, {etapa}: "
+                                   f"{base['median_ms']:.2f} ms -> {medida['median_ms']:.2f} ms")
+    return regresiones
+
+def main():
+    parser = argparse.ArgumentParser(description='Mide la latencia por audio de cada etapa de la extracción y la inferencia.')
+    parser.add_argument('--repeats', type=int, default=10, help='Repeticiones por etapa y caso.')
+    parser.add_argument('--signals', nargs='+', choices=SIGNALS, default=list(SIGNALS), help='Tipos de señal sintética.')
+    parser.add_argument('--durations', type=float, nargs='+', default=list(DURATIONS),
+                        help='Duraciones de los audios sintéticos, en segundos.')
+    parser.add_argument('--sample-rates', type=int, nargs='+', default=list(SAMPLE_RATES),
+                        help='Frecuencias de muestreo de los audios sintéticos.')
+    parser.add_argument('--f0', type=float, default=120.0, help='Frecuencia fundamental de los audios sintéticos.')
+    parser.add_argument('--modelos', default=CARPETA_MODELOS,
+                        help='Carpeta con pipelines.npz; si no existe se usan pipelines aleatorios.')
+    parser.add_argument('--output', help='Archivo JSON de resultados (por defecto, la salida estándar).')
+    parser.add_argument('--baseline', help='JSON de una corrida anterior contra el cual comparar.')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Empeoramiento relativo de la mediana que se considera regresión.')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        carpeta = args.modelos
+        if not os.path.exists(os.path.join(carpeta, ARCHIVO_PIPELINES)):
+            print(f'No hay {ARCHIVO_PIPELINES} en {carpeta}; se usan pipelines aleatorios.', file=sys.stderr)
+            carpeta = tmp_dir
+            synthetic_pipelines(carpeta)
+        load_pipelines(carpeta)
+
+        casos = []
+        for signal in args.signals:
+            for duration in args.durations:
+                for sampling_rate in args.sample_rates:
+                    print(f'{signal}, {duration:g} s, {sampling_rate} Hz...', file=sys.stderr)
+                    casos.append(run_case(signal, duration, sampling_rate, args.f0, args.repeats, carpeta))
+
+    resultados = {'version': RESULTS_VERSION, 'environment': environment(),
+                  'params': dict(EXTRACTION_PARAMS, stats=list(EXTRACTION_PARAMS['stats'])), 'cases': casos}
+
+    salida = json.dumps(resultados, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(salida + '\n')
+        print(f'Resultados guardados en {args.output}', file=sys.stderr)
+    else:
+        print(salida)
+
+    # Resumen legible: mediana de cada etapa por caso
+    for caso in casos:
+        medianas = ', '.join(f"{etapa} {medida['median_ms']:.2f}" for etapa, medida in caso['stages'].items() if 'median_ms' in medida)
+        print(f"{caso['signal']:6s} {caso['duration_s']:5g} s {caso['sample_rate']:6d} Hz (ms): {medianas}", file=sys.stderr)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regresiones = compare(resultados, json.load(file), args.tolerance)
+        for regresion in regresiones:
+            print(f'Regresión: {regresion}', file=sys.stderr)
+        if regresiones:
+            raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
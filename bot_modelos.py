@@ -1,26 +1,26 @@
 import os
+import time
 import asyncio
 import logging
-import pandas as pd
-import numpy as np
-import pickle
-import parselmouth
-from joblib import load
-from pyAudioAnalysis import ShortTermFeatures
-from scipy.io import wavfile
-from parselmouth.praat import call
-from pydub import AudioSegment
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
 from telegram.request import HTTPXRequest
 from telegram import ForceReply, Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, ReplyKeyboardRemove
 from telegram.ext import Application, CommandHandler, ContextTypes, MessageHandler, filters, ConversationHandler, CallbackQueryHandler
 from telegram.error import Forbidden
 
-# Leer el token desde el archivo token.txt
-with open('token_modelo.txt', 'r') as file:
-    TOKEN = file.read().strip()
+from caracteristicas import decode_voice, extract_features
+from inferencia import load_pipelines, predict_proba
+from metricas import Metrics, start_http_server, start_log_summary
+from concurrencia import PerChatUpdateProcessor
+
+# Archivo con el token del bot (se lee en main)
+TOKEN_FILE = 'token_modelo.txt'
+
+# Puerto local del endpoint /metrics (0 lo desactiva) y cada cuántos segundos se resume la latencia en el log
+METRICS_PORT = int(os.environ.get('METRICAS_PUERTO', 9108))
+METRICS_LOG_INTERVAL = int(os.environ.get('METRICAS_INTERVALO', 300))
 
-# Enable logging
-logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 # Define conversation states
@@ -36,98 +36,57 @@ audio_instructions = [
     "Graba el sexto audio contando de manera pausada los números del 0 al 9.",
 ]
 
-# Carpeta donde se encuentran los modelos exportados
-carpeta_modelos = 'modelos_exportados'
-
-# Listas para cargar los modelos, escaladores y PCA
-modelos_cargados = []
-scalers_cargados = []
-pca_cargados = []
+# Cantidad de audios que se procesan a la vez; el resto espera su turno sin bloquear el bot
+MAX_INFERENCE_WORKERS = os.cpu_count() or 1
 
-# Leer los archivos de la carpeta
-for i in range(6):  # Asumiendo que hay 6 modelos
-    # Generar nombres de archivo
-    nombre_modelo = f'modelo_{i + 1}.pkl'
-    nombre_scaler = f'escalador_{i + 1}.pkl'
-    nombre_pca = f'pca_{i + 1}.pkl'
+# Ejecutor donde corre la inferencia (se crea en main) y semáforo que limita la concurrencia
+inference_executor = None
+inference_slots = asyncio.Semaphore(MAX_INFERENCE_WORKERS)
 
-    archivo_modelo = os.path.join(carpeta_modelos, nombre_modelo)
-    archivo_scaler = os.path.join(carpeta_modelos, nombre_scaler)
-    archivo_pca = os.path.join(carpeta_modelos, nombre_pca)
+# Audios aceptados que todavía no terminaron de procesarse (en curso + en cola)
+inference_pending = 0
 
-    # Cargar el modelo
-    modelo = load(archivo_modelo)
-    modelos_cargados.append(modelo)
+# Latencia de cada etapa por consigna: download, queue, decode, pyaudioanalysis, praat, scoring, executor, total
+metrics = Metrics()
 
-    # Cargar el escalador
-    scaler = load(archivo_scaler)
-    scalers_cargados.append(scaler)
+def classify_audio(voice_bytes, audio_index):
+    """Decode the audio, extract its features and return the probability of 'Hombre' and the time of each stage.
 
-    # Cargar el PCA
-    pca = load(archivo_pca)
-    pca_cargados.append(pca)
+    Runs in the executor, so the timings are returned to be recorded in the main process.
+    """
+    tiempos = {}
 
-def measure_feats(voiceID, f0min=75, f0max=500, unit="Hertz"):
+    # Decode in memory, without ffmpeg or intermediate files
+    inicio = time.perf_counter()
+    samples, sample_rate = decode_voice(voice_bytes)
+    tiempos['decode'] = time.perf_counter() - inicio
 
-    columns = [
-            "F0_mean", "F0_std", "I_mean", "I_std", "hnr",
-            "localJitter", "localabsoluteJitter", "rapJitter", "ppq5Jitter",
-            "localShimmer", "localdbShimmer", "apq3Shimmer", "aqpq5Shimmer", "apq11Shimmer"
-            ]
+    # Extract features and apply scaler, PCA and model for the current audio
+    features = extract_features(samples, sample_rate, tiempos=tiempos)
+    inicio = time.perf_counter()
+    probability = predict_proba(features, audio_index)  # Probability of being 'Hombre'
+    tiempos['scoring'] = time.perf_counter() - inicio
+    return probability, tiempos
 
+async def run_inference(voice_bytes, audio_index):
+    """Run classify_audio in the executor, waiting for a free slot without blocking the event loop."""
+    global inference_pending
+    inference_pending += 1
+    logger.info(f"Inferencias pendientes: {inference_pending} (en cola: {max(0, inference_pending - MAX_INFERENCE_WORKERS)})")
     try:
-        sound = parselmouth.Sound(voiceID)
-
-        pitch = call(sound, "To Pitch", 0.0, f0min, f0max)
-        meanF0 = call(pitch, "Get mean", 0, 0, unit)
-        stdevF0 = call(pitch, "Get standard deviation", 0 ,0, unit)
-
-        intensity = call(sound, "To Intensity", 75, 0.0)
-        meanI = call(intensity, "Get mean", 0, 0)
-        stdevI = call(intensity, "Get standard deviation", 0 ,0)
-
-        harmonicity = call(sound, "To Harmonicity (cc)", 0.01, 75, 0.1, 1.0)
-        hnr = call(harmonicity, "Get mean", 0, 0)
-
-        pointProcess = call(sound, "To PointProcess (periodic, cc)", f0min, f0max)
-        localJitter = call(pointProcess, "Get jitter (local)", 0, 0, 0.0001, 0.02, 1.3)
-        localabsoluteJitter = call(pointProcess, "Get jitter (local, absolute)", 0, 0, 0.0001, 0.02, 1.3)
-        rapJitter = call(pointProcess, "Get jitter (rap)", 0, 0, 0.0001, 0.02, 1.3)
-        ppq5Jitter = call(pointProcess, "Get jitter (ppq5)", 0, 0, 0.0001, 0.02, 1.3)
-        localShimmer =  call([sound, pointProcess], "Get shimmer (local)", 0, 0, 0.0001, 0.02, 1.3, 1.6)
-        localdbShimmer = call([sound, pointProcess], "Get shimmer (local_dB)", 0, 0, 0.0001, 0.02, 1.3, 1.6)
-        apq3Shimmer = call([sound, pointProcess], "Get shimmer (apq3)", 0, 0, 0.0001, 0.02, 1.3, 1.6)
-        aqpq5Shimmer = call([sound, pointProcess], "Get shimmer (apq5)", 0, 0, 0.0001, 0.02, 1.3, 1.6)
-        apq11Shimmer =  call([sound, pointProcess], "Get shimmer (apq11)", 0, 0, 0.0001, 0.02, 1.3, 1.6)
-
-        features = meanF0, stdevF0, meanI,stdevI, hnr, localJitter, localabsoluteJitter, rapJitter, ppq5Jitter, localShimmer, localdbShimmer, apq3Shimmer, aqpq5Shimmer, apq11Shimmer
-        df = pd.DataFrame([features], columns=columns)
-
-        return df
-    except parselmouth.PraatError:
-        
-        print(voiceID)
-        df = pd.DataFrame([0]*14, columns=columns)
-        
-        return df
-
-def extract_estimators_from_audio(audio):
-    Fs, x = wavfile.read(audio)
-    if len(x.shape) > 1:
-        x = np.mean(x, axis=1)
-    F, f_names = ShortTermFeatures.feature_extraction(signal=x, sampling_rate=Fs, window=0.050*Fs, step=0.025*Fs, deltas=False)
-    df = pd.DataFrame(F).T
-    df.columns = f_names
-    df_estimador = pd.DataFrame()
-    for col in df.columns:
-
-        df_estimador[f'{col}_mean'] = [df[col].mean()]
-        df_estimador[f'{col}_std'] = [df[col].std()]
-
-    return df_estimador
-
-def extract_features_and_create_dataframe(audio):
-    return pd.concat([extract_estimators_from_audio(audio), measure_feats(audio)], axis=1)
+        with metrics.timer('queue', audio_index + 1):
+            await inference_slots.acquire()
+        try:
+            loop = asyncio.get_running_loop()
+            with metrics.timer('executor', audio_index + 1):
+                probability, tiempos = await loop.run_in_executor(inference_executor, partial(classify_audio, voice_bytes, audio_index))
+        finally:
+            inference_slots.release()
+    finally:
+        inference_pending -= 1
+
+    metrics.observe_all(tiempos, audio_index + 1)
+    return probability
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send a message when the command /help is issued."""
@@ -144,8 +103,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     await update.message.reply_text("Empecemos.")
     
     context.user_data['audio_index'] = 0
-    context.user_data['audio_files'] = []
-    context.user_data['total_probability'] = 0
+    context.user_data['probabilities'] = {}
     await update.message.reply_text(audio_instructions[context.user_data['audio_index']])
         
     return ASK_VOICE
@@ -167,42 +125,24 @@ async def download_voice(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     """Download the voice message."""
     logger.debug("download_voice called")
     audio_index = context.user_data['audio_index']
-    
-    # Define the folder based on the user's data
-    folder = 'audios'        
-    subfolder = f'audio_{audio_index + 1}'
-    
-    full_folder_path = os.path.join(folder, subfolder)
-    if not os.path.exists(full_folder_path):
-        os.makedirs(full_folder_path)
+    chat_id = update.effective_chat.id
 
-    # Save the file in the correct folder
     file_id = context.user_data['file_id']
-    new_file = await context.bot.get_file(file_id)
-    ogg_path = os.path.join(full_folder_path, f"audio_{audio_index + 1}.ogg")
-    wav_path = os.path.join(full_folder_path, f"audio_{audio_index + 1}.wav")
+    inicio = time.perf_counter()
+    with metrics.timer('download', audio_index + 1):
+        new_file = await context.bot.get_file(file_id)
 
-    await new_file.download_to_drive(ogg_path)
+        # The voice note stays in memory for the whole request, so concurrent users never
+        # share files and there is nothing to clean up afterwards
+        voice_bytes = bytes(await new_file.download_as_bytearray())
 
-    # Convert the file to WAV format and save it in the same folder
-    audio = AudioSegment.from_ogg(ogg_path)
-    audio.export(wav_path, format="wav")
-    os.remove(ogg_path)
-    
-    # Extract features
-    data = extract_features_and_create_dataframe(wav_path)
-    #data = data.drop(columns=['category'])
-    
-    # Apply scaler, PCA and model for the current audio
-    scaled_data = scalers_cargados[audio_index].transform(data)
-    pca_data = pca_cargados[audio_index].transform(scaled_data)
-    probability = modelos_cargados[audio_index].predict_proba(pca_data)[:, 1]  # Probability of being 'Hombre'
-    
-    # Accumulate probabilities
-    context.user_data['total_probability'] += probability[0]
+    # Decoding, feature extraction and models run outside the event loop
+    probability = await run_inference(voice_bytes, audio_index)
+    metrics.observe('total', time.perf_counter() - inicio, audio_index + 1)
 
-    context.user_data['audio_files'].append(wav_path)
-    logger.debug(f"Downloaded and converted {ogg_path} to {wav_path}")
+    # One probability per prompt: a discarded recording is dropped and a new one replaces it
+    context.user_data['probabilities'][audio_index] = probability
+    logger.debug(f"Scored audio {audio_index + 1} for chat {chat_id}: {probability:.3f}")
 
 async def ask_voice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handle the voice message and ask for confirmation."""
@@ -243,8 +183,7 @@ async def confirm_audio(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
             await query.message.reply_text(f"{audio_instructions[audio_index]}")
             return ASK_VOICE
         else:
-            total_probability = context.user_data['total_probability']
-            average_probability = total_probability / len(audio_instructions)
+            average_probability = sum(context.user_data['probabilities'].values()) / len(audio_instructions)
             
             await query.message.reply_text(f"Audio cargado con éxito.")
             await asyncio.sleep(1)
@@ -272,7 +211,7 @@ async def confirm_audio(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
             
             return ConversationHandler.END
     else:
-        os.remove(context.user_data['audio_files'].pop())
+        context.user_data['probabilities'].pop(context.user_data['audio_index'], None)
         await query.message.reply_text("Audio desechado. Por favor, graba nuevamente:")
         return ASK_VOICE
 
@@ -284,8 +223,28 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     return ConversationHandler.END
 
 def main() -> None:
-    
-    application = Application.builder().token(TOKEN).build()
+    # Enable logging
+    logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.DEBUG)
+
+    # Leer el token desde el archivo token.txt
+    with open(TOKEN_FILE, 'r') as file:
+        TOKEN = file.read().strip()
+
+    # Load the models before creating the pool so that the forked workers inherit them
+    load_pipelines()
+
+    global inference_executor
+    inference_executor = ProcessPoolExecutor(max_workers=MAX_INFERENCE_WORKERS)
+
+    # Per-stage latency: Prometheus endpoint on localhost and a periodic summary in the log
+    if METRICS_PORT:
+        start_http_server(metrics, METRICS_PORT)
+    if METRICS_LOG_INTERVAL:
+        start_log_summary(metrics, METRICS_LOG_INTERVAL)
+
+    # Updates from different chats are handled concurrently while inference runs in the executor;
+    # those of the same chat are processed one at a time so the conversation stays sequential
+    application = Application.builder().token(TOKEN).concurrent_updates(PerChatUpdateProcessor()).build()
 
     # Add conversation handler with the states ASK_USERNAME, ASK_SEX, ASK_AGE, ASK_SMOKER, ASK_CIGARETTES_PER_WEEK, ASK_YEARS_SMOKING, ASK_VOICE, ASK_CONFIRM
     conv_handler = ConversationHandler(
@@ -306,7 +265,10 @@ def main() -> None:
     application.add_handler(CommandHandler("help", help_command))
 
     # Run the bot until the user presses Ctrl-C
-    application.run_polling(timeout = 20)
+    try:
+        application.run_polling(timeout = 20)
+    finally:
+        inference_executor.shutdown()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,186 @@
+"""Extracción de características acústicas compartida por la extracción, el entrenamiento y los bots.
+
+Las dependencias pesadas (parselmouth, pyAudioAnalysis, soundfile, scipy) se importan
+recién cuando se usan, así que importar este módulo no carga nada más que NumPy.
+"""
+import io
+import os
+import math
+import numpy as np
+from functools import lru_cache
+
+# Nombres de las características de corto plazo de pyAudioAnalysis (deltas=False)
+SHORT_TERM_NAMES = (
+        ["zcr", "energy", "energy_entropy", "spectral_centroid", "spectral_spread",
+         "spectral_entropy", "spectral_flux", "spectral_rolloff"]
+        + [f"mfcc_{i}" for i in range(1, 14)]
+        + [f"chroma_{i}" for i in range(1, 13)]
+        + ["chroma_std"]
+        )
+
+# Estadísticos por defecto de cada característica de corto plazo
+SUMMARY_STATS = ("mean", "std")
+
+# Estadísticos disponibles además de los percentiles "pNN" (por ejemplo "p25")
+_REDUCERS = {
+        "mean": lambda F: F.mean(axis=1),
+        "std": lambda F: F.std(axis=1, ddof=1),  # mismo estimador que pandas
+        "median": lambda F: np.median(F, axis=1),
+        }
+
+@lru_cache(maxsize=None)
+def summary_columns(f_names, stats=SUMMARY_STATS):
+    return tuple(f"{name}_{stat}" for name in f_names for stat in stats)
+
+def summarize_features(F, stats=SUMMARY_STATS):
+    """Reduce la matriz (características x ventanas) a un vector con los estadísticos de cada fila."""
+    resumen = np.empty((F.shape[0], len(stats)))
+    percentiles = [(j, float(stat[1:])) for j, stat in enumerate(stats) if stat.startswith("p")]
+    if percentiles:
+        valores = np.percentile(F, [q for _, q in percentiles], axis=1)
+        for (j, _), fila in zip(percentiles, valores):
+            resumen[:, j] = fila
+    for j, stat in enumerate(stats):
+        if not stat.startswith("p"):
+            resumen[:, j] = _REDUCERS[stat](F)
+
+    # Orden intercalado: zcr_mean, zcr_std, energy_mean, ...
+    return resumen.ravel()
+
+def feature_columns(stats=SUMMARY_STATS):
+    return list(summary_columns(tuple(SHORT_TERM_NAMES), stats)) + PRAAT_COLUMNS
+
+ESTIMATOR_COLUMNS = list(summary_columns(tuple(SHORT_TERM_NAMES)))
+
+PRAAT_COLUMNS = [
+        "F0_mean", "F0_std", "I_mean", "I_std", "hnr",
+        "localJitter", "localabsoluteJitter", "rapJitter", "ppq5Jitter",
+        "localShimmer", "localdbShimmer", "apq3Shimmer", "aqpq5Shimmer", "apq11Shimmer"
+        ]
+
+# Orden de las columnas de cada fila extraída
+FEATURE_COLUMNS = ESTIMATOR_COLUMNS + PRAAT_COLUMNS
+
+# Parámetros de extracción. Forman parte de la clave de la caché, así que cambiarlos la invalida.
+EXTRACTION_PARAMS = {
+        "window": 0.050,
+        "step": 0.025,
+        "f0min": 75.0,
+        "f0max": 500.0,
+        "unit": "Hertz",
+        "stats": SUMMARY_STATS,
+        }
+
+# Frecuencia de muestreo de trabajo: la de Opus, que es la de las notas de voz de Telegram
+TARGET_SAMPLE_RATE = 48000
+
+def decode_voice(data, target_sr=TARGET_SAMPLE_RATE):
+    """Decodifica en memoria los bytes OGG/Opus a un arreglo mono en [-1, 1] a target_sr."""
+    import soundfile as sf
+    from scipy.signal import resample_poly
+
+    samples, sample_rate = sf.read(io.BytesIO(data), dtype='float64', always_2d=True)
+    samples = samples.mean(axis=1)
+    if sample_rate != target_sr:
+        g = math.gcd(sample_rate, target_sr)
+        samples = resample_poly(samples, target_sr // g, sample_rate // g)
+    return samples, target_sr
+
+# Script de Praat que calcula las 14 medidas en una sola ejecución. El PointProcess se
+# obtiene del mismo objeto Pitch ("To PointProcess (cc)"), que es lo que "To PointProcess
+# (periodic, cc)" recalculaba por su cuenta con los mismos parámetros.
+PRAAT_SCRIPT = """
+form Medidas
+    positive f0min
+    positive f0max
+    word unit Hertz
+endform
+sound = selected ("Sound")
+pitch = To Pitch: 0.0, f0min, f0max
+meanF0 = Get mean: 0, 0, unit$
+stdevF0 = Get standard deviation: 0, 0, unit$
+selectObject: sound
+intensity = To Intensity: 75, 0.0
+meanI = Get mean: 0, 0
+stdevI = Get standard deviation: 0, 0
+selectObject: sound
+harmonicity = To Harmonicity (cc): 0.01, 75, 0.1, 1.0
+hnr = Get mean: 0, 0
+selectObject: sound, pitch
+pointProcess = To PointProcess (cc)
+localJitter = Get jitter (local): 0, 0, 0.0001, 0.02, 1.3
+localabsoluteJitter = Get jitter (local, absolute): 0, 0, 0.0001, 0.02, 1.3
+rapJitter = Get jitter (rap): 0, 0, 0.0001, 0.02, 1.3
+ppq5Jitter = Get jitter (ppq5): 0, 0, 0.0001, 0.02, 1.3
+selectObject: sound, pointProcess
+localShimmer = Get shimmer (local): 0, 0, 0.0001, 0.02, 1.3, 1.6
+localdbShimmer = Get shimmer (local_dB): 0, 0, 0.0001, 0.02, 1.3, 1.6
+apq3Shimmer = Get shimmer (apq3): 0, 0, 0.0001, 0.02, 1.3, 1.6
+aqpq5Shimmer = Get shimmer (apq5): 0, 0, 0.0001, 0.02, 1.3, 1.6
+apq11Shimmer = Get shimmer (apq11): 0, 0, 0.0001, 0.02, 1.3, 1.6
+removeObject: pitch, intensity, harmonicity, pointProcess
+writeInfo: meanF0, " ", stdevF0, " ", meanI, " ", stdevI, " ", hnr, " ",
+... localJitter, " ", localabsoluteJitter, " ", rapJitter, " ", ppq5Jitter, " ",
+... localShimmer, " ", localdbShimmer, " ", apq3Shimmer, " ", aqpq5Shimmer, " ", apq11Shimmer
+"""
+
+def measure_feats(voiceID, f0min=75, f0max=500, unit="Hertz"):
+    """Medidas de Praat de un parselmouth.Sound o de una ruta. Si Praat falla se propaga la
+    parselmouth.PraatError, así quien conoce el archivo la informa."""
+    import parselmouth
+    from parselmouth.praat import run
+
+    sound = voiceID if isinstance(voiceID, parselmouth.Sound) else parselmouth.Sound(voiceID)
+    _, salida = run(sound, PRAAT_SCRIPT, f0min, f0max, unit, capture_output=True)
+
+    # Praat escribe "--undefined--" cuando no puede calcular una medida (p. ej. sin voz)
+    return np.array([np.nan if valor == "--undefined--" else float(valor) for valor in salida.split()])
+
+def n_processes(n_jobs):
+    """Procesos para extraer en paralelo, con la convención de joblib de entrenamiento.py: -1 = todos los núcleos."""
+    if n_jobs == -1:
+        return os.cpu_count() or 1
+    if n_jobs < 1:
+        raise ValueError(f'La cantidad de procesos debe ser -1 (todos los núcleos) o al menos 1, no {n_jobs}')
+    return n_jobs
+
+def load_audio(file_path):
+    """Lee un audio como arreglo mono en [-1, 1] y su frecuencia de muestreo."""
+    import soundfile as sf
+
+    samples, sample_rate = sf.read(file_path, dtype='float64', always_2d=True)
+    return samples.mean(axis=1), sample_rate
+
+def extract_estimators_from_audio(samples, Fs, stats=SUMMARY_STATS, window=0.050, step=0.025):
+        from pyAudioAnalysis import ShortTermFeatures
+
+        # pyAudioAnalysis divide la señal por 2**15, es decir, espera valores en la escala de int16
+        x = samples * 2.0 ** 15
+        F, f_names = ShortTermFeatures.feature_extraction(signal = x,
+                                                          sampling_rate = Fs,
+                                                          window = window*Fs,
+                                                          step = step*Fs,
+                                                          deltas=False)
+
+        return summarize_features(F, stats)
+        
+def extract_features(samples, sample_rate, params=EXTRACTION_PARAMS, tiempos=None):
+    """Vector de características de un audio mono en [-1, 1], en el orden de feature_columns(params["stats"]).
+
+    Si se pasa un diccionario tiempos, se guarda en él la duración en segundos de cada
+    biblioteca ("pyaudioanalysis" y "praat").
+    """
+    import time
+    import parselmouth
+
+    inicio = time.perf_counter()
+    estimadores = extract_estimators_from_audio(samples, sample_rate, params["stats"], params["window"], params["step"])
+    medio = time.perf_counter()
+    sound = parselmouth.Sound(samples, sampling_frequency=sample_rate)
+    medidas = measure_feats(sound, f0min=params["f0min"], f0max=params["f0max"], unit=params["unit"])
+    fin = time.perf_counter()
+
+    if tiempos is not None:
+        tiempos["pyaudioanalysis"] = medio - inicio
+        tiempos["praat"] = fin - medio
+    return np.concatenate([estimadores, medidas])
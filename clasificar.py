@@ -0,0 +1,98 @@
+import os
+import re
+import time
+import argparse
+import importlib.util
+import numpy as np
+import pandas as pd
+
+from inferencia import CARPETA_MODELOS, N_MODELOS, extract_batch, load_pipelines, predict_proba_batch
+
+# Extensiones de audio que se clasifican
+AUDIO_EXTENSIONS = ('.wav', '.ogg', '.oga', '.opus', '.flac')
+
+# Carpetas con los audios de cada consigna: audio_1 ... audio_6
+AUDIO_DIR_PATTERN = re.compile(r'^audio_(\d+)$')
+
+def find_recordings(root_dir):
+    """Lista de (grupo, usuario, índice de audio, ruta) de todos los audios bajo carpetas audio_{i}.
+
+    El grupo es la ruta de la carpeta que contiene a audio_{i} (por ejemplo Hombre_Fuma, o "."
+    para audios/audio_{i}) y el usuario es el nombre del archivo sin extensión.
+    """
+    grabaciones = []
+    for dir_path, dir_names, file_names in os.walk(root_dir):
+        dir_names.sort()
+        match = AUDIO_DIR_PATTERN.match(os.path.basename(dir_path))
+        if not match or not 1 <= int(match.group(1)) <= N_MODELOS:
+            continue
+
+        grupo = os.path.relpath(os.path.dirname(dir_path), root_dir)
+        for file_name in sorted(file_names):
+            if file_name.lower().endswith(AUDIO_EXTENSIONS):
+                usuario = os.path.splitext(file_name)[0]
+                grabaciones.append((grupo, usuario, int(match.group(1)) - 1, os.path.join(dir_path, file_name)))
+    return grabaciones
+
+def classify_directory(root_dir, n_workers=1, chunksize=8, carpeta=CARPETA_MODELOS):
+    """Dataframe con la probabilidad de 'Hombre' por usuario para cada audio y en promedio."""
+    grabaciones = find_recordings(root_dir)
+    print(f'{len(grabaciones)} audios encontrados en {root_dir}.')
+
+    # Cargar los modelos antes de crear los procesos, así los heredan
+    load_pipelines(carpeta)
+
+    # Un audio que no se puede leer queda como fila de NaN y no corta la corrida
+    paths = [path for _, _, _, path in grabaciones]
+    inicio = time.perf_counter()
+    features = extract_batch(paths, n_jobs=n_workers, chunksize=chunksize, skip_errors=True, progress_every=100)
+
+    audio_indices = np.array([audio_index for _, _, audio_index, _ in grabaciones], dtype=int)
+    probabilidades = predict_proba_batch(features, audio_indices, carpeta) if len(paths) else np.empty(0)
+
+    df = pd.DataFrame({
+            'grupo': [grupo for grupo, _, _, _ in grabaciones],
+            'usuario': [usuario for _, usuario, _, _ in grabaciones],
+            'audio': [f'prob_audio_{audio_index + 1}' for audio_index in audio_indices],
+            'probabilidad': probabilidades,
+            })
+
+    # Una fila por usuario, con una columna por audio y el promedio de los audios disponibles;
+    # a diferencia de pivot_table, groupby conserva a los usuarios cuyos audios fallaron todos
+    resultado = df.groupby(['grupo', 'usuario', 'audio'])['probabilidad'].first().unstack('audio')
+    resultado = resultado.reindex(columns=[f'prob_audio_{i + 1}' for i in range(N_MODELOS)])
+    resultado['n_audios'] = resultado.notna().sum(axis=1)
+    resultado['prob_hombre'] = resultado[[f'prob_audio_{i + 1}' for i in range(N_MODELOS)]].mean(axis=1)
+
+    print(f'Clasificación completada en {time.perf_counter() - inicio:.1f} s.')
+    return resultado.reset_index()
+
+def main():
+    parser = argparse.ArgumentParser(description='Clasifica en lote los audios de un árbol de carpetas audio_{i}.')
+    parser.add_argument('root_dir', help='Carpeta raíz (por ejemplo ./audios o ./ con Hombre_Fuma/audio_1, ...).')
+    parser.add_argument('output', help='Archivo de salida: .csv o .parquet.')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Cantidad de procesos para la extracción (1 = secuencial, -1 = todos los núcleos).')
+    parser.add_argument('--chunksize', type=int, default=8,
+                        help='Cantidad de archivos que se envían juntos a cada proceso.')
+    parser.add_argument('--modelos', default=CARPETA_MODELOS,
+                        help='Carpeta con los modelos exportados por entrenamiento.py.')
+    args = parser.parse_args()
+    if args.workers < 1 and args.workers != -1:
+        parser.error('--workers debe ser -1 (todos los núcleos) o al menos 1')
+
+    # Verificar el motor de Parquet antes de procesar, no al exportar
+    if args.output.endswith('.parquet') and not any(importlib.util.find_spec(motor) for motor in ('pyarrow', 'fastparquet')):
+        parser.error('para exportar a .parquet hace falta pyarrow o fastparquet; instala uno o usa una salida .csv')
+
+    resultado = classify_directory(args.root_dir, n_workers=args.workers,
+                                   chunksize=args.chunksize, carpeta=args.modelos)
+
+    if args.output.endswith('.parquet'):
+        resultado.to_parquet(args.output, index=False)
+    else:
+        resultado.to_csv(args.output, index=False)
+    print(f'{len(resultado)} usuarios exportados a {args.output}')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""Procesamiento concurrente de updates de Telegram, en orden dentro de cada chat.
+
+Con concurrent_updates(True) PTB atiende todos los updates a la vez, incluso los de un mismo
+usuario, y un ConversationHandler deja de ver los mensajes en secuencia (dos notas de voz
+seguidas se procesan en el mismo estado). PerChatUpdateProcessor mantiene la concurrencia
+entre chats distintos pero procesa los updates de cada chat de a uno, en el orden de llegada.
+"""
+import asyncio
+
+from telegram.ext import BaseUpdateProcessor
+
+# Updates que se procesan a la vez como máximo, sumando todos los chats (el valor de PTB para True)
+MAX_CONCURRENT_UPDATES = 256
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Un lock por chat: updates de chats distintos en paralelo, los de un mismo chat en serie."""
+
+    def __init__(self, max_concurrent_updates=MAX_CONCURRENT_UPDATES):
+        super().__init__(max_concurrent_updates)
+        self.locks = {}
+        self.waiting = {}
+
+    async def do_process_update(self, update, coroutine):
+        chat = getattr(update, 'effective_chat', None)
+        if chat is None:
+            await coroutine
+            return
+
+        # El lock de un chat se borra cuando no queda ningún update suyo esperando
+        chat_id = chat.id
+        lock = self.locks.setdefault(chat_id, asyncio.Lock())
+        self.waiting[chat_id] = self.waiting.get(chat_id, 0) + 1
+        try:
+            async with lock:
+                await coroutine
+        finally:
+            self.waiting[chat_id] -= 1
+            if not self.waiting[chat_id]:
+                del self.waiting[chat_id]
+                del self.locks[chat_id]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
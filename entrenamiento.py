@@ -1,31 +1,71 @@
 import os
+import copy
+import time
+import zlib
 import pickle
+import argparse
+import itertools
 import pandas as pd
 import numpy as np
-from sklearn.decomposition import PCA
+from joblib import Parallel, delayed
+from sklearn.decomposition import PCA, IncrementalPCA
 from sklearn.preprocessing import StandardScaler
 from sklearn.metrics import accuracy_score
 from sklearn.model_selection import StratifiedKFold
-from sklearn.linear_model import LogisticRegression
+from sklearn.linear_model import LogisticRegression, SGDClassifier
 
-# Ruta de la carpeta que contiene los archivos CSV
-input_dir = './csv'
+from almacen import is_store, read_store, read_store_chunks
+from inferencia import export_pipelines
 
-# Diccionario para almacenar los dataframes
-dataframes = {}
+# Cantidad de pliegues de la validación cruzada
+N_FOLDS = 5
 
-# Leer cada archivo CSV de la carpeta y convertirlo a un dataframe
-print(f'Leyendo archivos CSV desde la carpeta {input_dir}...')
-for file_name in os.listdir(input_dir):
-    if file_name.endswith('.csv'):
+# Grilla por defecto de la búsqueda de hiperparámetros
+SEARCH_C = [0.001, 0.01, 0.1, 1.0, 10.0, 100.0]
+SEARCH_SOLVERS = ['lbfgs', 'liblinear']
+
+# Filas por bloque y pasadas sobre los datos en el entrenamiento por bloques
+STREAMING_CHUNKSIZE = 10000
+STREAMING_EPOCHS = 5
+
+def list_datasets(input_dir):
+    """Diccionario nombre -> ruta con los datasets de la carpeta (almacenes columnares o CSV).
+
+    Se listan en orden, para que modelo_{i} corresponda siempre a audio_{i}. Si un dataset
+    está en ambos formatos se usa el columnar.
+    """
+    datasets = {}
+    for file_name in sorted(os.listdir(input_dir)):
         file_path = os.path.join(input_dir, file_name)
-        print(f'Leyendo {file_name}...')
-        df = pd.read_csv(file_path)
-        # Guardar el dataframe en el diccionario con el nombre del archivo sin extensión como clave
-        dataframes[file_name.replace('.csv', '')] = df
-        print(f'{file_name} leído y convertido a dataframe.')
+        if is_store(file_path):
+            datasets[file_name] = file_path
+        elif file_name.endswith('.csv') and not is_store(file_path[:-len('.csv')]):
+            datasets[file_name[:-len('.csv')]] = file_path
+    return datasets
+
+def read_datasets(input_dir):
+    """Diccionario nombre -> dataframe con los datasets de la carpeta."""
+    dataframes = {}
+
+    # Leer cada almacén columnar o archivo CSV de la carpeta y convertirlo a un dataframe
+    print(f'Leyendo datasets desde la carpeta {input_dir}...')
+    for name, path in list_datasets(input_dir).items():
+        print(f'Leyendo {os.path.basename(path)}...')
+        if is_store(path):
+            dataframes[name] = read_store(path)
+            print(f'{name} leído del almacén columnar.')
+        else:
+            dataframes[name] = pd.read_csv(path)
+            print(f'{os.path.basename(path)} leído y convertido a dataframe.')
 
-print('Lectura de archivos completada.')
+    print('Lectura de archivos completada.')
+    return dataframes
+
+def iter_chunks(path, chunksize):
+    """Bloques de un dataset como dataframes, sin leerlo completo."""
+    if is_store(path):
+        return read_store_chunks(path, chunksize)
+    return pd.read_csv(path, chunksize=chunksize)
 
 # Función para elegir el número óptimo de componentes
 def elegir_componentes(varianza_acumulada, varianza_diferencia, umbral_varianza=0.7, umbral_incremento=0.05):
@@ -35,100 +75,340 @@ def elegir_componentes(varianza_acumulada, varianza_diferencia, umbral_varianza=
                 return i + 1
     return len(varianza_acumulada)
 
-# Listas para guardar modelos, escaladores y PCA entrenados
-modelos_entrenados = []
-scalers_entrenados = []
-pca_entrenados = []
-resultados = []
-
-# Procesamiento de cada dataframe
-for name, df in dataframes.items():
-    print(f'\nProcesando el dataset: {name}')
+def preprocess(name, df):
+    """Estandariza el dataset y calcula su PCA completo, una sola vez.
 
+    Devuelve el escalador, el PCA con todas las componentes, X proyectado sobre todas ellas,
+    el número de componentes elegido con elegir_componentes, y y las columnas. Como las
+    componentes están ordenadas, reducir a k componentes es tomar las primeras k columnas.
+    """
     # Separar características y etiquetas
-    X = df.drop(columns=['category'])
-    y = df['category'].replace({'Hombre': 1, 'Mujer': 0})
+    # El almacén columnar guarda float32; los ajustes se hacen en float64
+    X = df.drop(columns=['category', 'id'], errors='ignore').astype(np.float64)
+    y = df['category'].replace({'Hombre': 1, 'Mujer': 0}).to_numpy()
 
     # Estandarización en todo el conjunto de datos
-    print(' - Estandarizando las características...')
     scaler = StandardScaler().fit(X)
     X_standar = scaler.transform(X)
-    #X_standar = pd.DataFrame(X_standar, columns=X.columns)
 
     # Aplicación de PCA en todo el conjunto de datos
-    print(' - Aplicando PCA y seleccionando número óptimo de componentes...')
-    pca = PCA()
-    pca.fit(X_standar)
+    pca = PCA(svd_solver='full')
+    X_full = pca.fit_transform(X_standar)
     varianza_explicada = pca.explained_variance_ratio_
     varianza_acumulada = varianza_explicada.cumsum()
     varianza_diferencia = np.diff(varianza_acumulada, prepend=0)
 
     n_componentes_optimo = elegir_componentes(varianza_acumulada, varianza_diferencia)
-    print(f' - Número óptimo de componentes seleccionados: {n_componentes_optimo}')
+    print(f' - {name}: número óptimo de componentes seleccionados: {n_componentes_optimo}')
 
-    # Reducir el conjunto de datos usando el número de componentes seleccionados
-    pca = PCA(n_components=n_componentes_optimo).fit(X_standar)
-    X_pca = pca.transform(X_standar)
+    return scaler, pca, X_full, n_componentes_optimo, y, list(X.columns)
 
-    # Validación cruzada con 5 pliegues
-    cv = StratifiedKFold(n_splits=5, shuffle=True, random_state=42)
-    accuracy_promedio = 0
+def truncate_pca(pca, n_components):
+    """Copia del PCA completo reducida a sus primeras n_components componentes, sin reajustarlo."""
+    pca_reducido = copy.deepcopy(pca)
+    pca_reducido.n_components = n_components
+    pca_reducido.n_components_ = n_components
+    pca_reducido.components_ = pca.components_[:n_components]
+    pca_reducido.explained_variance_ = pca.explained_variance_[:n_components]
+    pca_reducido.explained_variance_ratio_ = pca.explained_variance_ratio_[:n_components]
+    pca_reducido.singular_values_ = pca.singular_values_[:n_components]
+    return pca_reducido
 
-    for fold, (train_index, test_index) in enumerate(cv.split(X_pca, y)):
-        print(f'   - Fold {fold + 1}: Entrenando modelo...')
-        X_train, X_test = X_pca[train_index], X_pca[test_index]
-        y_train, y_test = y.values[train_index], y.values[test_index]
+def fit_and_score(X_full, y, train_index, test_index, n_components, C=1.0, solver='lbfgs'):
+    """Entrena en un pliegue con las primeras n_components componentes y devuelve su accuracy."""
+    X_pca = X_full[:, :n_components]
+    X_train, X_test = X_pca[train_index], X_pca[test_index]
+    y_train, y_test = y[train_index], y[test_index]
 
-        # Entrenamiento temporal en cada pliegue
-        model = LogisticRegression()
-        model.fit(X_train, y_train)
+    # Entrenamiento temporal en cada pliegue
+    model = LogisticRegression(C=C, solver=solver)
+    model.fit(X_train, y_train)
 
-        # Evaluación del modelo en este pliegue
-        y_pred = model.predict(X_test)
-        accuracy = accuracy_score(y_test, y_pred)
-        accuracy_promedio += accuracy
-        print(f'   - Fold {fold + 1}: Accuracy = {accuracy * 100.0:.2f}%')
+    # Evaluación del modelo en este pliegue
+    y_pred = model.predict(X_test)
+    return accuracy_score(y_test, y_pred)
 
-    accuracy_promedio /= 5
-    print(f' - Accuracy promedio para el Audio_{name}: {accuracy_promedio * 100.0:.2f}%')
+def fit_final(X_full, y, n_components, C=1.0, solver='lbfgs'):
+    model_final = LogisticRegression(C=C, solver=solver)
+    model_final.fit(X_full[:, :n_components], y)
+    return model_final
 
-    # Entrenar el modelo, escalador y PCA final en todo el conjunto de datos
-    print(' - Entrenando modelo final en todo el conjunto de datos...')
-    model_final = LogisticRegression()
-    model_final.fit(X_pca, y)
+def search_candidates(n_max, components=None, Cs=SEARCH_C, solvers=SEARCH_SOLVERS, n_iter=None, seed=42):
+    """Combinaciones (n_components, C, solver) a evaluar: la grilla completa o n_iter elegidas al azar."""
+    componentes = [k for k in (components or range(1, n_max + 1)) if k <= n_max]
+    grilla = list(itertools.product(componentes, Cs, solvers))
+    if n_iter is not None and n_iter < len(grilla):
+        rng = np.random.default_rng(seed)
+        grilla = [grilla[i] for i in sorted(rng.choice(len(grilla), size=n_iter, replace=False))]
+    return grilla
 
-    # Guardar el modelo, escalador y PCA entrenados
-    modelos_entrenados.append(model_final)
-    scalers_entrenados.append(scaler)
-    pca_entrenados.append(pca)
+def search_hyperparameters(parallel, nombres, preprocesados, cv, args):
+    """Evalúa todas las combinaciones sobre la descomposición ya calculada y devuelve la mejor por dataset."""
+    tareas = []
+    for name_idx, (_, _, X_full, _, y, _) in enumerate(preprocesados):
+        pliegues = list(cv.split(X_full, y))
+        candidatos = search_candidates(X_full.shape[1], args.components, args.C, args.solvers, args.n_iter)
+        for candidato in candidatos:
+            for train_index, test_index in pliegues:
+                tareas.append((name_idx, candidato, train_index, test_index))
+
+    print(f' - {len(tareas)} ajustes ({len(tareas) // N_FOLDS} combinaciones x {N_FOLDS} pliegues)')
+    accuracies = parallel(delayed(fit_and_score)(preprocesados[name_idx][2], preprocesados[name_idx][4],
+                                                 train_index, test_index, *candidato)
+                          for name_idx, candidato, train_index, test_index in tareas)
+
+    # Accuracy promedio de cada combinación en cada dataset
+    resultados = {}
+    for (name_idx, candidato, _, _), accuracy in zip(tareas, accuracies):
+        resultados.setdefault((name_idx, candidato), []).append(accuracy)
+    resultados = pd.DataFrame([(nombres[name_idx], *candidato, np.mean(valores))
+                               for (name_idx, candidato), valores in resultados.items()],
+                              columns=['dataset', 'n_components', 'C', 'solver', 'accuracy'])
+
+    # Ante empates se prefiere el modelo con menos componentes y más regularización
+    resultados = resultados.sort_values(['dataset', 'accuracy', 'n_components', 'C'],
+                                        ascending=[True, False, True, True])
+    mejores = resultados.groupby('dataset', sort=False).head(1).set_index('dataset')
+    return resultados, mejores
+
+def split_chunk(df):
+    """X (float64), y y máscara de validación de un bloque.
+
+    Las filas de validación se eligen por el id, así son las mismas en todas las pasadas.
+    """
+    X = df.drop(columns=['category', 'id'], errors='ignore').to_numpy(dtype=np.float64)
+    y = df['category'].replace({'Hombre': 1, 'Mujer': 0}).to_numpy(dtype=int)
+    validacion = np.array([zlib.crc32(str(id_).encode()) % N_FOLDS == 0 for id_ in df['id']], dtype=bool)
+    return X, y, validacion
+
+def train_streaming(name, path, chunksize=STREAMING_CHUNKSIZE, epochs=STREAMING_EPOCHS, alpha=1e-4):
+    """Entrena escalador, PCA y regresión logística leyendo el dataset por bloques.
+
+    Usa StandardScaler.partial_fit, IncrementalPCA y SGDClassifier con pérdida logística, así
+    la memoria depende del tamaño del bloque y no del dataset. Un pliegue de validación (1 de
+    cada N_FOLDS filas, según su id) se usa para estimar la accuracy; el modelo final se entrena
+    con todas las filas en las mismas pasadas.
+    """
+    columnas = None
+
+    # Primera pasada: media y desvío de cada característica
+    scaler = StandardScaler()
+    for df in iter_chunks(path, chunksize):
+        if columnas is None:
+            columnas = [column for column in df.columns if column not in ('category', 'id')]
+        X, _, _ = split_chunk(df)
+        scaler.partial_fit(X)
+
+    # Segunda pasada: PCA incremental sobre los datos estandarizados
+    pca = None
+    for df in iter_chunks(path, chunksize):
+        X, _, _ = split_chunk(df)
+        if pca is None:
+            # El primer bloque tiene que tener al menos tantas filas como componentes
+            pca = IncrementalPCA(n_components=min(len(columnas), len(X)))
+        pca.partial_fit(scaler.transform(X))
+
+    varianza_acumulada = pca.explained_variance_ratio_.cumsum()
+    varianza_diferencia = np.diff(varianza_acumulada, prepend=0)
+    n_componentes = elegir_componentes(varianza_acumulada, varianza_diferencia)
+    pca = truncate_pca(pca, n_componentes)
+    print(f' - {name}: número óptimo de componentes seleccionados: {n_componentes}')
 
-print('\nProceso completado para todos los datasets.')
+    # Pasadas de entrenamiento: un modelo sin el pliegue de validación y otro con todas las filas
+    clases = np.array([0, 1])
+    model_validacion = SGDClassifier(loss='log_loss', alpha=alpha, random_state=42)
+    model_final = SGDClassifier(loss='log_loss', alpha=alpha, random_state=42)
+    for _ in range(epochs):
+        for df in iter_chunks(path, chunksize):
+            X, y, validacion = split_chunk(df)
+            X_pca = pca.transform(scaler.transform(X))
+            if (~validacion).any():
+                model_validacion.partial_fit(X_pca[~validacion], y[~validacion], classes=clases)
+            model_final.partial_fit(X_pca, y, classes=clases)
 
-# Crear la carpeta de destino si no existe
-carpeta_destino = 'modelos_exportados'
-if not os.path.exists(carpeta_destino):
-    os.makedirs(carpeta_destino)
+    # Última pasada: accuracy en el pliegue de validación
+    aciertos = total = 0
+    for df in iter_chunks(path, chunksize):
+        X, y, validacion = split_chunk(df)
+        if validacion.any():
+            y_pred = model_validacion.predict(pca.transform(scaler.transform(X[validacion])))
+            aciertos += int((y_pred == y[validacion]).sum())
+            total += int(validacion.sum())
+    accuracy = aciertos / total if total else float('nan')
 
-# Exportar modelos, escaladores y PCA
-for i, (modelo, escalador, pca) in enumerate(zip(modelos_entrenados, scalers_entrenados, pca_entrenados)):
-    # Crear nombres de archivo únicos
-    archivo_modelo = os.path.join(carpeta_destino, f'modelo_{i+1}.pkl')
-    archivo_scaler = os.path.join(carpeta_destino, f'escalador_{i+1}.pkl')
-    archivo_pca = os.path.join(carpeta_destino, f'pca_{i+1}.pkl')
+    return scaler, pca, model_final, columnas, accuracy
 
-    # Guardar el modelo
-    with open(archivo_modelo, 'wb') as file:
-        pickle.dump(modelo, file)
-    print(f'Modelo {i+1} exportado como {archivo_modelo}')
+def run_streaming(args):
+    """Entrenamiento por bloques de todos los datasets, para corpus que no entran en memoria."""
+    datasets = list_datasets(args.input_dir)
+    nombres = list(datasets)
 
-    # Guardar el escalador
-    with open(archivo_scaler, 'wb') as file:
-        pickle.dump(escalador, file)
-    print(f'Scaler {i+1} exportado como {archivo_scaler}')
+    print(f'Entrenamiento por bloques de {args.chunksize} filas ({args.epochs} pasadas) en {args.input_dir}...')
+    inicio = time.perf_counter()
+    entrenados = Parallel(n_jobs=args.n_jobs)(
+            delayed(train_streaming)(name, datasets[name], args.chunksize, args.epochs, args.alpha) for name in nombres)
+    entrenamiento = time.perf_counter() - inicio
 
-    # Guardar el PCA
-    with open(archivo_pca, 'wb') as file:
-        pickle.dump(pca, file)
-    print(f'PCA {i+1} exportado como {archivo_pca}')
+    for name, (_, _, _, _, accuracy) in zip(nombres, entrenados):
+        print(f' - Accuracy en validación para el Audio_{name}: {accuracy * 100.0:.2f}%')
+
+    inicio = time.perf_counter()
+    export_models([model for _, _, model, _, _ in entrenados],
+                  [scaler for scaler, _, _, _, _ in entrenados],
+                  [pca for _, pca, _, _, _ in entrenados],
+                  [columnas for _, _, _, columnas, _ in entrenados])
+    exportacion = time.perf_counter() - inicio
+
+    print(f'\nTiempo por etapa (n_jobs={args.n_jobs}):')
+    print(f' - entrenamiento por bloques: {entrenamiento:.2f} s')
+    print(f' - exportación: {exportacion:.2f} s')
+
+def export_models(modelos_entrenados, scalers_entrenados, pca_entrenados, columnas_entrenadas, carpeta_destino='modelos_exportados'):
+    # Crear la carpeta de destino si no existe
+    if not os.path.exists(carpeta_destino):
+        os.makedirs(carpeta_destino)
+
+    # Exportar modelos, escaladores y PCA
+    for i, (modelo, escalador, pca) in enumerate(zip(modelos_entrenados, scalers_entrenados, pca_entrenados)):
+        # Crear nombres de archivo únicos
+        archivo_modelo = os.path.join(carpeta_destino, f'modelo_{i+1}.pkl')
+        archivo_scaler = os.path.join(carpeta_destino, f'escalador_{i+1}.pkl')
+        archivo_pca = os.path.join(carpeta_destino, f'pca_{i+1}.pkl')
+
+        # Guardar el modelo
+        with open(archivo_modelo, 'wb') as file:
+            pickle.dump(modelo, file)
+        print(f'Modelo {i+1} exportado como {archivo_modelo}')
+
+        # Guardar el escalador
+        with open(archivo_scaler, 'wb') as file:
+            pickle.dump(escalador, file)
+        print(f'Scaler {i+1} exportado como {archivo_scaler}')
+
+        # Guardar el PCA
+        with open(archivo_pca, 'wb') as file:
+            pickle.dump(pca, file)
+        print(f'PCA {i+1} exportado como {archivo_pca}')
+
+    # Exportar los seis pipelines fusionados (escalador + PCA + modelo) en un único archivo
+    if any(columnas != columnas_entrenadas[0] for columnas in columnas_entrenadas):
+        raise ValueError('Los datasets tienen columnas distintas; no se pueden exportar en un único archivo.')
+    archivo_pipelines = export_pipelines(modelos_entrenados, scalers_entrenados, pca_entrenados, columnas_entrenadas[0],
+                                         carpeta=carpeta_destino)
+    print(f'Pipelines fusionados exportados como {archivo_pipelines}')
+
+def main():
+    parser = argparse.ArgumentParser(description='Entrena un modelo de regresión logística por cada audio.')
+    parser.add_argument('--input-dir', default='./caracteristicas',
+                        help='Carpeta con los datasets de características (almacenes columnares o CSV).')
+    parser.add_argument('--n-jobs', type=int, default=1,
+                        help='Procesos para entrenar datasets y pliegues en paralelo (-1 = todos los núcleos).')
+    parser.add_argument('--search', choices=['grid', 'random'],
+                        help='Busca componentes de PCA, C y solver por validación cruzada en lugar de usar el criterio fijo.')
+    parser.add_argument('--n-iter', type=int, default=30,
+                        help='Combinaciones a evaluar por dataset en la búsqueda aleatoria.')
+    parser.add_argument('--components', type=int, nargs='+',
+                        help='Componentes de PCA a evaluar (por defecto, todas).')
+    parser.add_argument('--C', type=float, nargs='+', default=SEARCH_C,
+                        help='Valores de C (inversa de la regularización) a evaluar.')
+    parser.add_argument('--solvers', nargs='+', default=SEARCH_SOLVERS,
+                        help='Solvers de LogisticRegression a evaluar.')
+    parser.add_argument('--streaming', action='store_true',
+                        help='Entrena leyendo los datasets por bloques, con estimadores incrementales.')
+    parser.add_argument('--chunksize', type=int, default=STREAMING_CHUNKSIZE,
+                        help='Filas por bloque en el entrenamiento por bloques.')
+    parser.add_argument('--epochs', type=int, default=STREAMING_EPOCHS,
+                        help='Pasadas sobre los datos del clasificador en el entrenamiento por bloques.')
+    parser.add_argument('--alpha', type=float, default=1e-4,
+                        help='Regularización L2 del clasificador en el entrenamiento por bloques.')
+    args = parser.parse_args()
+    if args.search != 'random':
+        args.n_iter = None
+    if args.streaming:
+        if args.search:
+            parser.error('--search no está disponible con --streaming')
+        return run_streaming(args)
+
+    tiempos = {}
+    inicio = time.perf_counter()
+    dataframes = read_datasets(args.input_dir)
+    tiempos['lectura'] = time.perf_counter() - inicio
+
+    nombres = list(dataframes)
+    with Parallel(n_jobs=args.n_jobs) as parallel:
+        # Estandarización y PCA de cada dataset
+        print('\nEstandarizando y aplicando PCA a cada dataset...')
+        inicio = time.perf_counter()
+        preprocesados = parallel(delayed(preprocess)(name, dataframes[name]) for name in nombres)
+        tiempos['estandarización y PCA'] = time.perf_counter() - inicio
+
+        cv = StratifiedKFold(n_splits=N_FOLDS, shuffle=True, random_state=42)
+
+        # Hiperparámetros de cada dataset: los del criterio fijo, o los mejores de la búsqueda
+        if args.search:
+            print(f'\nBúsqueda de hiperparámetros ({args.search})...')
+            inicio = time.perf_counter()
+            resultados, mejores = search_hyperparameters(parallel, nombres, preprocesados, cv, args)
+            tiempos['búsqueda de hiperparámetros'] = time.perf_counter() - inicio
+            parametros = [(int(mejores.loc[name, 'n_components']), float(mejores.loc[name, 'C']), mejores.loc[name, 'solver'])
+                          for name in nombres]
+            for name, (k, C, solver) in zip(nombres, parametros):
+                print(f' - {name}: n_components={k}, C={C}, solver={solver} '
+                      f'(accuracy {mejores.loc[name, "accuracy"] * 100.0:.2f}%)')
+        else:
+            parametros = [(k, 1.0, 'lbfgs') for _, _, _, k, _, _ in preprocesados]
+
+        # Validación cruzada con 5 pliegues: todos los pliegues de todos los datasets a la vez
+        print('\nValidación cruzada...')
+        inicio = time.perf_counter()
+        tareas = [(name_idx, fold, train_index, test_index)
+                  for name_idx, (_, _, X_full, _, y, _) in enumerate(preprocesados)
+                  for fold, (train_index, test_index) in enumerate(cv.split(X_full, y))]
+        accuracies = parallel(delayed(fit_and_score)(preprocesados[name_idx][2], preprocesados[name_idx][4],
+                                                     train_index, test_index, *parametros[name_idx])
+                              for name_idx, _, train_index, test_index in tareas)
+        tiempos['validación cruzada'] = time.perf_counter() - inicio
+
+        # Entrenar el modelo final de cada dataset en todo el conjunto de datos
+        print('\nEntrenando modelos finales en todo el conjunto de datos...')
+        inicio = time.perf_counter()
+        modelos_entrenados = parallel(delayed(fit_final)(X_full, y, *parametros[name_idx])
+                                      for name_idx, (_, _, X_full, _, y, _) in enumerate(preprocesados))
+        tiempos['entrenamiento final'] = time.perf_counter() - inicio
+
+    for name_idx, name in enumerate(nombres):
+        print(f'\nResultados para el dataset: {name}')
+        accuracy_promedio = 0
+        for (tarea_idx, fold, _, _), accuracy in zip(tareas, accuracies):
+            if tarea_idx == name_idx:
+                print(f'   - Fold {fold + 1}: Accuracy = {accuracy * 100.0:.2f}%')
+                accuracy_promedio += accuracy
+        accuracy_promedio /= N_FOLDS
+        if args.search:
+            # Son los mismos pliegues con los que se eligieron los hiperparámetros: la estimación es optimista
+            print(f' - Accuracy de selección para el Audio_{name}: {accuracy_promedio * 100.0:.2f}% '
+                  f'(pliegues usados en la búsqueda; sobreestima el accuracy con datos nuevos)')
+        else:
+            print(f' - Accuracy promedio para el Audio_{name}: {accuracy_promedio * 100.0:.2f}%')
+
+    print('\nProceso completado para todos los datasets.')
+
+    # Guardar el modelo, escalador y PCA entrenados
+    inicio = time.perf_counter()
+    export_models(modelos_entrenados,
+                  [scaler for scaler, _, _, _, _, _ in preprocesados],
+                  [truncate_pca(pca, k) for (_, pca, _, _, _, _), (k, _, _) in zip(preprocesados, parametros)],
+                  [columnas for _, _, _, _, _, columnas in preprocesados])
+    if args.search:
+        archivo_busqueda = os.path.join('modelos_exportados', 'busqueda_hiperparametros.csv')
+        resultados.to_csv(archivo_busqueda, index=False)
+        print(f'Resultados de la búsqueda exportados como {archivo_busqueda}')
+    tiempos['exportación'] = time.perf_counter() - inicio
 
+    print(f'\nTiempo por etapa (n_jobs={args.n_jobs}):')
+    for etapa, segundos in tiempos.items():
+        print(f' - {etapa}: {segundos:.2f} s')
+    print(f' - total: {sum(tiempos.values()):.2f} s')
 
+if __name__ == "__main__":
+    main()
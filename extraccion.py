@@ -1,134 +1,265 @@
 import os
-import random
+import json
+import shutil
+import hashlib
+import argparse
 import pandas as pd
 import numpy as np
-import inspect
-import librosa
-import math
-import parselmouth
-import joblib
-from parselmouth.praat import call
-from pyAudioAnalysis import audioBasicIO, ShortTermFeatures
-
-def measure_feats(voiceID, f0min=75, f0max=500, unit="Hertz"):
-
-    columns = [
-            "F0_mean", "F0_std", "I_mean", "I_std", "hnr",
-            "localJitter", "localabsoluteJitter", "rapJitter", "ppq5Jitter",
-            "localShimmer", "localdbShimmer", "apq3Shimmer", "aqpq5Shimmer", "apq11Shimmer"
-            ]
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
 
+from almacen import is_store, read_ids, read_schema, write_store
+from caracteristicas import (EXTRACTION_PARAMS, PRAAT_COLUMNS, SUMMARY_STATS, extract_estimators_from_audio,
+                             extract_features, feature_columns, load_audio, n_processes)
+
+# Carpeta del almacén columnar (un dataset audio_{i} por consigna) y de la caché por contenido
+STORE_ROOT = './caracteristicas'
+CACHE_DIR = './cache_caracteristicas'
+
+def file_hash(file_path):
+    """Hash SHA-1 del contenido del archivo."""
+    sha1 = hashlib.sha1()
+    with open(file_path, 'rb') as file:
+        for bloque in iter(lambda: file.read(1 << 20), b''):
+            sha1.update(bloque)
+    return sha1.hexdigest()
+
+def recording_id(folder_path, file_name):
+    """Identificador estable de una grabación: depende del grupo (p. ej. Hombre_Fuma) y del usuario."""
+    grupo = os.path.basename(os.path.dirname(os.path.normpath(folder_path)))
+    usuario = os.path.splitext(file_name)[0]
+    return hashlib.sha1(f'{grupo}/{usuario}'.encode()).hexdigest()[:8]
+
+def params_hash(params):
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:16]
+
+def open_feature_cache(cache_dir, params=EXTRACTION_PARAMS, invalidate=True):
+    """Devuelve la carpeta de la caché para estos parámetros y, con invalidate, borra la de parámetros anteriores."""
+    params_dir = os.path.join(cache_dir, params_hash(params))
+    if invalidate and os.path.isdir(cache_dir):
+        for entrada in os.listdir(cache_dir):
+            entrada_path = os.path.join(cache_dir, entrada)
+            if entrada_path != params_dir and os.path.isdir(entrada_path):
+                print(f'Invalidando caché con parámetros anteriores: {entrada_path}')
+                shutil.rmtree(entrada_path)
+
+    os.makedirs(params_dir, exist_ok=True)
+    with open(os.path.join(params_dir, 'params.json'), 'w') as file:
+        json.dump(params, file, indent=2, sort_keys=True)
+    return params_dir
+
+def extract_row(file_path, params=EXTRACTION_PARAMS, cache_dir=None):
+    if cache_dir is not None:
+        cache_path = os.path.join(cache_dir, f'{file_hash(file_path)}.npy')
+        if os.path.exists(cache_path):
+            print(f'Archivo en caché: {os.path.basename(file_path)}')
+            return np.load(cache_path)
+
+    import parselmouth
+
+    print(f'Procesando archivo: {os.path.basename(file_path)}')
+    samples, sample_rate = load_audio(file_path)
     try:
-        sound = parselmouth.Sound(voiceID)
-
-        pitch = call(sound, "To Pitch", 0.0, f0min, f0max)
-        meanF0 = call(pitch, "Get mean", 0, 0, unit)
-        stdevF0 = call(pitch, "Get standard deviation", 0 ,0, unit)
-
-        intensity = call(sound, "To Intensity", 75, 0.0)
-        meanI = call(intensity, "Get mean", 0, 0)
-        stdevI = call(intensity, "Get standard deviation", 0 ,0)
-
-        harmonicity = call(sound, "To Harmonicity (cc)", 0.01, 75, 0.1, 1.0)
-        hnr = call(harmonicity, "Get mean", 0, 0)
-
-        pointProcess = call(sound, "To PointProcess (periodic, cc)", f0min, f0max)
-        localJitter = call(pointProcess, "Get jitter (local)", 0, 0, 0.0001, 0.02, 1.3)
-        localabsoluteJitter = call(pointProcess, "Get jitter (local, absolute)", 0, 0, 0.0001, 0.02, 1.3)
-        rapJitter = call(pointProcess, "Get jitter (rap)", 0, 0, 0.0001, 0.02, 1.3)
-        ppq5Jitter = call(pointProcess, "Get jitter (ppq5)", 0, 0, 0.0001, 0.02, 1.3)
-        localShimmer =  call([sound, pointProcess], "Get shimmer (local)", 0, 0, 0.0001, 0.02, 1.3, 1.6)
-        localdbShimmer = call([sound, pointProcess], "Get shimmer (local_dB)", 0, 0, 0.0001, 0.02, 1.3, 1.6)
-        apq3Shimmer = call([sound, pointProcess], "Get shimmer (apq3)", 0, 0, 0.0001, 0.02, 1.3, 1.6)
-        aqpq5Shimmer = call([sound, pointProcess], "Get shimmer (apq5)", 0, 0, 0.0001, 0.02, 1.3, 1.6)
-        apq11Shimmer =  call([sound, pointProcess], "Get shimmer (apq11)", 0, 0, 0.0001, 0.02, 1.3, 1.6)
-
-        features = meanF0, stdevF0, meanI,stdevI, hnr, localJitter, localabsoluteJitter, rapJitter, ppq5Jitter, localShimmer, localdbShimmer, apq3Shimmer, aqpq5Shimmer, apq11Shimmer
-        df = pd.DataFrame([features], columns=columns)
-
-        return df
-    
-    except parselmouth.PraatError:
-        
-        print(voiceID)
-        
-        df = pd.DataFrame([0]*14, columns=columns)
-        
-        return df
-    
-def extract_estimators_from_audio(audio_file_path):
-
-        Fs, x = audioBasicIO.read_audio_file(audio_file_path)
-        F, f_names = ShortTermFeatures.feature_extraction(signal = x,
-                                                          sampling_rate = Fs,
-                                                          window = 0.050*Fs,
-                                                          step = 0.025*Fs,
-                                                          deltas=False)
-
-        df = pd.DataFrame(F).T
-        df.columns = f_names
-
-        df_estimador = pd.DataFrame()
-
-        for col in df.columns:
-            df_estimador[f'{col}_mean'] = [df[col].mean()]
-            df_estimador[f'{col}_std'] = [df[col].std()]
-
-        return df_estimador
-        
-def extract_features_and_create_dataframe(folder_path, category_1):
+        fila = extract_features(samples, sample_rate, params)
+    except parselmouth.PraatError as e:
+        # Como antes, las medidas de Praat quedan en cero, pero ahora se informa qué archivo falló
+        mensaje = ' '.join(str(e).split())
+        print(f'Praat no pudo medir {file_path}: {mensaje}; medidas de Praat en cero')
+        estimadores = extract_estimators_from_audio(samples, sample_rate, params['stats'], params['window'], params['step'])
+        fila = np.concatenate([estimadores, np.zeros(len(PRAAT_COLUMNS))])
+
+    if cache_dir is not None:
+        # Escritura atómica para que un proceso interrumpido no deje entradas a medias. Si otra
+        # corrida con otros parámetros borró la carpeta, la fila se devuelve igual sin cachearla
+        tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_path, 'wb') as file:
+                np.save(file, fila)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            print(f'No se pudo guardar {os.path.basename(file_path)} en la caché: {e}')
+
+    return fila
+
+def extract_features_and_create_dataframe(folder_path, category_1, executor=None, chunksize=1,
+                                          params=EXTRACTION_PARAMS, cache_dir=None, skip_ids=None):
     print(f'Extrayendo características de la carpeta: {folder_path}\n')
-    final_df = pd.DataFrame()
 
-    for file_name in os.listdir(folder_path):
-        file_path = os.path.join(folder_path, file_name)
-        if os.path.isfile(file_path):
-            print(f'Procesando archivo: {file_name}')
-            df_fila = pd.concat([extract_estimators_from_audio(file_path),
-                                measure_feats(file_path, f0min=75, f0max=500, unit="Hertz")],
-                                axis=1)
-            final_df = pd.concat([final_df, df_fila], ignore_index=True)
+    # Orden fijo de archivos para que las filas salgan siempre en el mismo orden
+    file_names = [file_name for file_name in sorted(os.listdir(folder_path))
+                  if os.path.isfile(os.path.join(folder_path, file_name))]
+    ids = [recording_id(folder_path, file_name) for file_name in file_names]
+
+    # En modo incremental se omiten las grabaciones que ya están en el CSV
+    if skip_ids:
+        nuevos = [(file_name, id_) for file_name, id_ in zip(file_names, ids) if id_ not in skip_ids]
+        print(f'{len(file_names) - len(nuevos)} archivos ya extraídos, {len(nuevos)} nuevos.')
+        file_names = [file_name for file_name, _ in nuevos]
+        ids = [id_ for _, id_ in nuevos]
+
+    file_paths = [os.path.join(folder_path, file_name) for file_name in file_names]
+
+    # executor.map devuelve los resultados en el orden de entrada aunque los procesos terminen desordenados
+    extract = partial(extract_row, params=params, cache_dir=cache_dir)
+    if executor is not None:
+        filas = executor.map(extract, file_paths, chunksize=chunksize)
+    else:
+        filas = map(extract, file_paths)
+
+    # Cada fila se copia una sola vez en la matriz y el dataframe se arma al final
+    columnas = feature_columns(params["stats"])
+    matriz = np.empty((len(file_paths), len(columnas)))
+    for fila_idx, fila in enumerate(filas):
+        matriz[fila_idx] = fila
 
+    final_df = pd.DataFrame(matriz, columns=columnas)
+    final_df.insert(0, 'id', ids)
     final_df['category'] = category_1
 
     print(f'\nCaracterísticas extraídas para {folder_path}.')
     return final_df
 
-# Diccionario para almacenar los dataframes de cada conjunto de audios
-dataframes = {}
+def read_existing_ids(csv_path, columnas):
+    """Ids ya presentes en el CSV, o None si hay que regenerarlo completo."""
+    if not os.path.exists(csv_path):
+        return None
+
+    encabezado = list(pd.read_csv(csv_path, nrows=0).columns)
+    if encabezado != ['id'] + columnas + ['category']:
+        print(f'Las columnas de {csv_path} no coinciden con la extracción actual; se regenerará completo.')
+        return None
+
+    return set(pd.read_csv(csv_path, usecols=['id'], dtype=str)['id'])
+
+def read_existing_store_ids(store_dir, columnas):
+    """Ids ya presentes en el almacén columnar, o None si hay que regenerarlo completo."""
+    if not is_store(store_dir):
+        return None
+
+    if read_schema(store_dir)['columns'] != columnas:
+        print(f'Las columnas de {store_dir} no coinciden con la extracción actual; se regenerará completo.')
+        return None
+
+    return set(read_ids(store_dir))
+
+def main():
+    parser = argparse.ArgumentParser(description='Extrae las características acústicas de los audios recopilados.')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Cantidad de procesos para la extracción (1 = secuencial, -1 = todos los núcleos).')
+    parser.add_argument('--chunksize', type=int, default=4,
+                        help='Cantidad de archivos que se envían juntos a cada proceso.')
+    parser.add_argument('--stats', nargs='+', default=list(SUMMARY_STATS),
+                        help='Estadísticos por característica: mean, std, median o percentiles pNN (p. ej. p25).')
+    parser.add_argument('--window', type=float, default=EXTRACTION_PARAMS['window'],
+                        help='Duración de la ventana de análisis de corto plazo, en segundos.')
+    parser.add_argument('--step', type=float, default=EXTRACTION_PARAMS['step'],
+                        help='Paso entre ventanas de análisis, en segundos.')
+    parser.add_argument('--f0min', type=float, default=EXTRACTION_PARAMS['f0min'],
+                        help='Frecuencia fundamental mínima para Praat, en Hz.')
+    parser.add_argument('--f0max', type=float, default=EXTRACTION_PARAMS['f0max'],
+                        help='Frecuencia fundamental máxima para Praat, en Hz.')
+    parser.add_argument('--cache-dir', default=CACHE_DIR,
+                        help='Carpeta de la caché de características por contenido de archivo.')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Recalcula todas las características sin usar la caché.')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Extrae solo las grabaciones que todavía no están en la salida y las agrega al final.')
+    parser.add_argument('--formato', choices=['columnar', 'csv', 'ambos'], default='columnar',
+                        help='Formato de salida: almacén columnar float32 en ./caracteristicas, CSV en ./csv, o ambos.')
+    args = parser.parse_args()
+    if args.workers < 1 and args.workers != -1:
+        parser.error('--workers debe ser -1 (todos los núcleos) o al menos 1')
+
+    params = dict(EXTRACTION_PARAMS, stats=tuple(args.stats), window=args.window, step=args.step,
+                  f0min=args.f0min, f0max=args.f0max)
+    cache_dir = None if args.no_cache else open_feature_cache(args.cache_dir, params)
+
+    n_workers = n_processes(args.workers)
+    executor = ProcessPoolExecutor(max_workers=n_workers) if n_workers > 1 else None
+    if executor is not None:
+        print(f'Extracción en paralelo con {n_workers} procesos (chunksize={args.chunksize}).\n')
+
+    opciones = dict(executor=executor, chunksize=args.chunksize, params=params, cache_dir=cache_dir)
+
+    # Diccionario para almacenar los dataframes de cada conjunto de audios
+    dataframes = {}
+
+    # Directorio base donde se encuentran las carpetas de los audios
+    base_dir = './'
+
+    # Carpetas de salida del almacén columnar y de los CSV
+    store_root = STORE_ROOT
+    output_dir = './csv'
+    escribir_columnar = args.formato in ('columnar', 'ambos')
+    escribir_csv = args.formato in ('csv', 'ambos')
+    if escribir_csv:
+        os.makedirs(output_dir, exist_ok=True)
+
+    try:
+        # Iterar sobre las 6 carpetas de audios
+        for i in range(1, 7):
+            print(f'Procesando audios en la carpeta {i}...')
+            key = f'audio_{i}'
+
+            # Ids ya exportados en cada formato de salida (None: ese formato se regenera completo)
+            ids_por_formato = {}
+            if args.incremental:
+                columnas = feature_columns(params['stats'])
+                if escribir_columnar:
+                    ids_por_formato['columnar'] = read_existing_store_ids(os.path.join(store_root, key), columnas)
+                if escribir_csv:
+                    ids_por_formato['csv'] = read_existing_ids(os.path.join(output_dir, f'{key}.csv'), columnas)
 
-# Directorio base donde se encuentran las carpetas de los audios
-base_dir = './'
+            # Solo se omiten las grabaciones que ya están en todos los formatos de salida
+            existentes = list(ids_por_formato.values())
+            ids_existentes = set.intersection(*existentes) if existentes and None not in existentes else None
 
-# Iterar sobre las 6 carpetas de audios
-for i in range(1, 7):
-    print(f'Procesando audios en la carpeta {i}...')
+            men_1_folder_path = os.path.join(base_dir, f'Hombre_Fuma/audio_{i}')
+            men_2_folder_path = os.path.join(base_dir, f'Hombre_No_Fuma/audio_{i}')
+            women_1_folder_path = os.path.join(base_dir, f'Mujer_Fuma/audio_{i}')
+            women_2_folder_path = os.path.join(base_dir, f'Mujer_No_Fuma/audio_{i}')
 
-    men_1_folder_path = os.path.join(base_dir, f'Hombre_Fuma/audio_{i}')
-    men_2_folder_path = os.path.join(base_dir, f'Hombre_No_Fuma/audio_{i}')
-    women_1_folder_path = os.path.join(base_dir, f'Mujer_Fuma/audio_{i}')
-    women_2_folder_path = os.path.join(base_dir, f'Mujer_No_Fuma/audio_{i}')
+            men_1_df = extract_features_and_create_dataframe(men_1_folder_path, category_1=1, skip_ids=ids_existentes, **opciones)
+            men_2_df = extract_features_and_create_dataframe(men_2_folder_path, category_1=1, skip_ids=ids_existentes, **opciones)
+            women_1_df = extract_features_and_create_dataframe(women_1_folder_path, category_1=0, skip_ids=ids_existentes, **opciones)
+            women_2_df = extract_features_and_create_dataframe(women_2_folder_path, category_1=0, skip_ids=ids_existentes, **opciones)
 
-    men_1_df = extract_features_and_create_dataframe(men_1_folder_path, category_1=1)
-    men_2_df = extract_features_and_create_dataframe(men_2_folder_path, category_1=1)
-    women_1_df = extract_features_and_create_dataframe(women_1_folder_path, category_1=0)
-    women_2_df = extract_features_and_create_dataframe(women_2_folder_path, category_1=0)
+            print(f'Concatenando dataframes para la iteración {i}...')
+            df = pd.concat([men_1_df, women_1_df, men_2_df, women_2_df], ignore_index=True)
+            # Mezcla con semilla fija: dos extracciones de los mismos audios dan el mismo orden
+            df = df.sample(frac=1, random_state=42).reset_index(drop=True)
+            dataframes[key] = (df, ids_por_formato)
+            print(f'Dataframe para {key} creado y almacenado.\n')
+    finally:
+        if executor is not None:
+            executor.shutdown()
 
-    print(f'Concatenando dataframes para la iteración {i}...')
-    df = pd.concat([men_1_df, women_1_df, men_2_df, women_2_df], ignore_index=True)
-    df = df.sample(frac=1).reset_index(drop=True)
-    dataframes[f'audio_{i}'] = df
-    print(f'Dataframe para audio_{i} creado y almacenado.\n')
+    # Exportar cada dataframe al almacén columnar
+    if escribir_columnar:
+        print(f'Exportando dataframes a la carpeta {store_root}...\n')
+        for key, (df, ids_por_formato) in dataframes.items():
+            store_dir = os.path.join(store_root, key)
+            ids = ids_por_formato.get('columnar')
+            if ids is not None:
+                df = df[~df['id'].isin(ids)]
+            escritas = write_store(df, store_dir, append=ids is not None)
+            print(f'{escritas} filas {"agregadas a" if ids is not None else "exportadas a"} {store_dir}')
 
-# Exportar cada dataframe a un archivo CSV
-output_dir = './csv'
-os.makedirs(output_dir, exist_ok=True)
+    # Exportar cada dataframe a un archivo CSV
+    if escribir_csv:
+        print(f'Exportando dataframes a la carpeta {output_dir}...\n')
+        for key, (df, ids_por_formato) in dataframes.items():
+            csv_path = os.path.join(output_dir, f'{key}.csv')
+            ids = ids_por_formato.get('csv')
+            if ids is not None:
+                df = df[~df['id'].isin(ids)]
+                df.to_csv(csv_path, mode='a', header=False, index=False)
+                print(f'{len(df)} filas nuevas agregadas a {csv_path}')
+            else:
+                df.to_csv(csv_path, index=False)
+                print(f'Dataframe {key} exportado a {csv_path}')
 
-print(f'Exportando dataframes a la carpeta {output_dir}...\n')
-for key, df in dataframes.items():
-    csv_path = os.path.join(output_dir, f'{key}.csv')
-    df.to_csv(csv_path, index=False)
-    print(f'Dataframe {key} exportado a {csv_path}')
-    
-print('\nExportación completada.')
+    print('\nExportación completada.')
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""Carga de los modelos exportados por entrenamiento.py y cálculo de probabilidades.
+
+Cada audio tiene un StandardScaler, un PCA y una LogisticRegression. Como las tres etapas
+son lineales hasta la sigmoide, se colapsan en un único mapa afín (logit = x @ w + b) que
+entrenamiento.py exporta en modelos_exportados/pipelines.npz. Los modelos se cargan la
+primera vez que se piden, no al importar el módulo.
+"""
+import os
+import time
+import numpy as np
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+
+from caracteristicas import FEATURE_COLUMNS, decode_voice, extract_features, load_audio, n_processes
+
+# Carpeta donde se encuentran los modelos exportados
+CARPETA_MODELOS = 'modelos_exportados'
+
+# Artefacto único con los mapas afines de los seis audios
+ARCHIVO_PIPELINES = 'pipelines.npz'
+
+# Un modelo por cada audio de la encuesta
+N_MODELOS = 6
+
+def fuse_pipeline(scaler, pca, model):
+    """Colapsa StandardScaler + PCA + LogisticRegression binaria en (w, b), con logit = x @ w + b."""
+    componentes = pca.components_
+    if pca.whiten:
+        componentes = componentes / np.sqrt(pca.explained_variance_)[:, np.newaxis]
+    A = componentes.T @ model.coef_.ravel()
+    w = A / scaler.scale_
+    b = model.intercept_[0] - (scaler.mean_ / scaler.scale_ + pca.mean_) @ A
+    return w, b
+
+def export_pipelines(modelos, scalers, pcas, columns, carpeta=CARPETA_MODELOS):
+    """Guarda los mapas afines de todos los audios en un único .npz sin objetos de Python."""
+    fusionados = [fuse_pipeline(scaler, pca, modelo) for modelo, scaler, pca in zip(modelos, scalers, pcas)]
+    path = os.path.join(carpeta, ARCHIVO_PIPELINES)
+    np.savez(path,
+             coef=np.vstack([w for w, _ in fusionados]),
+             intercept=np.array([b for _, b in fusionados]),
+             columns=np.array(columns, dtype=str))
+    return path
+
+@lru_cache(maxsize=None)
+def load_models(carpeta=CARPETA_MODELOS):
+    """Listas de modelos, escaladores y PCA de cada audio (pickles), cargadas una sola vez por carpeta."""
+    from joblib import load
+
+    modelos_cargados = []
+    scalers_cargados = []
+    pca_cargados = []
+
+    for i in range(N_MODELOS):
+        modelos_cargados.append(load(os.path.join(carpeta, f'modelo_{i + 1}.pkl')))
+        scalers_cargados.append(load(os.path.join(carpeta, f'escalador_{i + 1}.pkl')))
+        pca_cargados.append(load(os.path.join(carpeta, f'pca_{i + 1}.pkl')))
+
+    return modelos_cargados, scalers_cargados, pca_cargados
+
+@lru_cache(maxsize=None)
+def load_pipelines(carpeta=CARPETA_MODELOS):
+    """Matriz de pesos (audios x características) e interceptos, en el orden de FEATURE_COLUMNS.
+
+    Si la carpeta solo tiene los pickles de un entrenamiento anterior, se fusionan al cargar.
+    """
+    path = os.path.join(carpeta, ARCHIVO_PIPELINES)
+    if not os.path.exists(path):
+        modelos, scalers, pcas = load_models(carpeta)
+        fusionados = [fuse_pipeline(scaler, pca, modelo) for modelo, scaler, pca in zip(modelos, scalers, pcas)]
+        columns = list(getattr(scalers[0], 'feature_names_in_', FEATURE_COLUMNS))
+        coef = np.vstack([w for w, _ in fusionados])
+        intercept = np.array([b for _, b in fusionados])
+    else:
+        with np.load(path, allow_pickle=False) as data:
+            coef, intercept, columns = data['coef'], data['intercept'], list(data['columns'])
+
+    # Reordenar los pesos si el entrenamiento usó otro orden de columnas
+    if columns != FEATURE_COLUMNS:
+        if set(columns) != set(FEATURE_COLUMNS):
+            raise ValueError(f'{carpeta}: las columnas del modelo no coinciden con las de caracteristicas.FEATURE_COLUMNS')
+        coef = coef[:, [columns.index(col) for col in FEATURE_COLUMNS]]
+
+    return np.ascontiguousarray(coef), intercept
+
+def predict_proba(features, audio_index, carpeta=CARPETA_MODELOS):
+    """Probabilidad de 'Hombre' para el vector de características del audio audio_index (0 a 5).
+
+    Lanza ValueError si alguna característica no es finita (p. ej. Praat no detectó voz),
+    en lugar de devolver una probabilidad NaN.
+    """
+    features = np.asarray(features, dtype=np.float64)
+    no_finitas = ~np.isfinite(features)
+    if no_finitas.any():
+        columnas = [col for col, mala in zip(FEATURE_COLUMNS, no_finitas) if mala]
+        raise ValueError(f'características no finitas en el audio {audio_index + 1}: {", ".join(columnas)}')
+
+    from scipy.special import expit
+
+    coef, intercept = load_pipelines(carpeta)
+    logit = features @ coef[audio_index] + intercept[audio_index]
+    # expit es la sigmoide sin overflow en exp para logits muy negativos
+    return expit(logit)
+
+def predict_proba_batch(features, audio_indices, carpeta=CARPETA_MODELOS):
+    """Probabilidades de 'Hombre' para una matriz de características (n x columnas).
+
+    audio_indices indica el audio (0 a 5) de cada fila; las filas de un mismo audio se
+    puntúan con una sola multiplicación de matriz por vector.
+    """
+    from scipy.special import expit
+
+    coef, intercept = load_pipelines(carpeta)
+    features = np.atleast_2d(features)
+    audio_indices = np.asarray(audio_indices)
+
+    logits = np.empty(len(features))
+    for audio_index in np.unique(audio_indices):
+        filas = audio_indices == audio_index
+        logits[filas] = features[filas] @ coef[audio_index] + intercept[audio_index]
+    return expit(logits)
+
+def features_from_source(source):
+    """Características de un audio dado como bytes OGG/Opus, ruta de archivo o tupla (samples, sample_rate)."""
+    if isinstance(source, (bytes, bytearray)):
+        samples, sample_rate = decode_voice(bytes(source))
+    elif isinstance(source, tuple):
+        samples, sample_rate = source
+    else:
+        samples, sample_rate = load_audio(source)
+    return extract_features(samples, sample_rate)
+
+def safe_features_from_source(source):
+    """Como features_from_source, pero con una fila de NaN si el audio no se puede procesar (para no cortar el lote)."""
+    try:
+        return features_from_source(source)
+    except Exception as e:
+        print(f'No se pudo procesar {source if isinstance(source, str) else "un audio"}: {e}')
+        return np.full(len(FEATURE_COLUMNS), np.nan)
+
+def extract_batch(sources, n_jobs=1, chunksize=1, executor=None, skip_errors=False, progress_every=None):
+    """Matriz de características de varios audios, extraídas en paralelo y en el orden de entrada.
+
+    n_jobs es la cantidad de procesos (-1 = todos los núcleos); se ignora si se pasa un executor.
+    Con skip_errors, un audio que falla deja una fila de NaN en lugar de cortar el lote. Con
+    progress_every se informa el avance cada esa cantidad de audios.
+    """
+    extract = safe_features_from_source if skip_errors else features_from_source
+    n_jobs = n_processes(n_jobs)
+    propio = None
+    if executor is None and n_jobs > 1:
+        executor = propio = ProcessPoolExecutor(max_workers=n_jobs)
+
+    filas = []
+    inicio = time.perf_counter()
+    try:
+        resultados = executor.map(extract, sources, chunksize=chunksize) if executor is not None else map(extract, sources)
+        for fila in resultados:
+            filas.append(fila)
+            if progress_every and len(filas) % progress_every == 0:
+                transcurrido = time.perf_counter() - inicio
+                print(f'{len(filas)}/{len(sources)} audios procesados ({len(filas) / transcurrido:.1f} audios/s)')
+    finally:
+        if propio is not None:
+            propio.shutdown()
+    return np.vstack(filas) if filas else np.empty((0, len(FEATURE_COLUMNS)))
+
+def score_batch(sources, audio_indices, n_jobs=1, chunksize=1, executor=None, carpeta=CARPETA_MODELOS):
+    """Probabilidad de 'Hombre' de cada audio de sources, de cualquier usuario y audio de la encuesta."""
+    features = extract_batch(sources, n_jobs=n_jobs, chunksize=chunksize, executor=executor)
+    return predict_proba_batch(features, audio_indices, carpeta)
+
+def score_speakers(speakers, n_jobs=1, chunksize=1, executor=None, carpeta=CARPETA_MODELOS):
+    """Probabilidad promedio de 'Hombre' de cada hablante, dado como lista de sus seis audios en orden.
+
+    Es el mismo promedio que calcula bot_modelos.py al terminar la conversación. Lanza
+    ValueError si algún hablante no tiene exactamente un audio por consigna.
+    """
+    incompletos = [idx for idx, audios in enumerate(speakers) if len(audios) != N_MODELOS]
+    if incompletos:
+        raise ValueError(f'Cada hablante necesita {N_MODELOS} audios; no los tienen los hablantes {incompletos}')
+
+    sources = [source for audios in speakers for source in audios]
+    audio_indices = [audio_index for audios in speakers for audio_index in range(len(audios))]
+    probabilidades = score_batch(sources, audio_indices, n_jobs=n_jobs, chunksize=chunksize,
+                                 executor=executor, carpeta=carpeta)
+    return probabilidades.reshape(len(speakers), N_MODELOS).mean(axis=1)
@@ -0,0 +1,322 @@
+"""Cola de ingesta de notas de voz para el bot de recopilación.
+
+El handler de Telegram solo descarga los bytes y los encola; la decodificación, la validación
+y la escritura del WAV las hacen trabajadores en segundo plano, en un pool de hilos, para que
+el event loop siga atendiendo a los demás usuarios. Opcionalmente, FeatureWriter extrae las
+características de cada audio confirmado y las agrega al almacén columnar de su consigna, y
+ArchiveWriter guarda la nota de voz original en el archivo compacto (archivo.py).
+"""
+import os
+import asyncio
+import logging
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from caracteristicas import decode_voice
+
+logger = logging.getLogger(__name__)
+
+# Audios encolados como máximo antes de pedirle al usuario que reintente
+INGEST_QUEUE_SIZE = 64
+
+# Trabajadores que procesan la cola en paralelo
+INGEST_WORKERS = min(4, os.cpu_count() or 1)
+
+# Reintentos ante errores de escritura y espera inicial entre ellos, en segundos (se duplica en cada intento)
+INGEST_RETRIES = 3
+INGEST_RETRY_DELAY = 1.0
+
+# Segundos que espera el handler por un lugar en la cola llena
+INGEST_SUBMIT_TIMEOUT = 10.0
+
+# Procesos para extraer características de los audios confirmados
+EXTRACTION_WORKERS = 1
+
+# Validación mínima de cada audio
+MIN_DURATION = 0.5
+MIN_PEAK = 1e-3
+
+class InvalidVoiceError(ValueError):
+    """El audio no se puede decodificar o no sirve (muy corto o en silencio); no se reintenta."""
+
+class IngestStoppedError(RuntimeError):
+    """La ingesta se detuvo antes de guardar el audio."""
+
+class IngestJob:
+    """Un audio pendiente de guardar. done se completa al terminar, con éxito o con error."""
+
+    def __init__(self, voice_bytes, wav_path):
+        self.voice_bytes = voice_bytes
+        self.wav_path = wav_path
+        self.discarded = False
+        self.error = None
+        self.done = asyncio.get_running_loop().create_future()
+
+    @property
+    def failed(self):
+        return self.done.done() and self.error is not None
+
+def process_voice(voice_bytes, tmp_path):
+    """Decodifica, valida y escribe el WAV (PCM de 16 bits) en tmp_path. Corre en el pool de hilos.
+
+    Los errores de decodificación y validación son InvalidVoiceError; solo la escritura se reintenta.
+    """
+    import numpy as np
+    import soundfile as sf
+
+    # Un audio corrupto o en un formato no soportado no se arregla reintentando
+    try:
+        samples, sample_rate = decode_voice(voice_bytes)
+    except Exception as e:
+        raise InvalidVoiceError(f'no se pudo decodificar el audio: {e}') from e
+    duration = len(samples) / sample_rate
+    if duration < MIN_DURATION:
+        raise InvalidVoiceError(f'audio demasiado corto ({duration:.2f} s)')
+    if np.abs(samples).max() < MIN_PEAK:
+        raise InvalidVoiceError('audio en silencio')
+
+    folder = os.path.dirname(tmp_path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    sf.write(tmp_path, samples, sample_rate, subtype='PCM_16', format='WAV')
+
+class IngestQueue:
+    """Cola acotada de audios con trabajadores en segundo plano, reintentos y descarte."""
+
+    def __init__(self, maxsize=INGEST_QUEUE_SIZE, n_workers=INGEST_WORKERS,
+                 retries=INGEST_RETRIES, retry_delay=INGEST_RETRY_DELAY, keep_bytes=False):
+        self.maxsize = maxsize
+        self.n_workers = n_workers
+        self.retries = retries
+        self.retry_delay = retry_delay
+        # Con keep_bytes los audios válidos conservan sus bytes originales hasta archivarse
+        self.keep_bytes = keep_bytes
+        self.queue = None
+        self.executor = None
+        self.workers = []
+        # Temporales en escritura, para borrar los que deja un trabajador detenido a mitad de un audio
+        self.tmp_paths = set()
+
+    async def start(self):
+        self.queue = asyncio.Queue(maxsize=self.maxsize)
+        self.executor = ThreadPoolExecutor(max_workers=self.n_workers, thread_name_prefix='ingesta')
+        self.workers = [asyncio.create_task(self.worker(), name=f'ingesta-{i}') for i in range(self.n_workers)]
+        logger.info(f"Cola de ingesta iniciada: {self.n_workers} trabajadores, hasta {self.maxsize} audios en cola")
+
+    async def stop(self, timeout=30.0):
+        """Espera a que se vacíe la cola (hasta timeout segundos) y detiene los trabajadores."""
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Se detiene la ingesta con {self.queue.qsize()} audios sin procesar")
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+
+        # Los audios que quedaron en la cola se marcan como fallidos, así nadie espera su done para siempre
+        while not self.queue.empty():
+            job = self.queue.get_nowait()
+            self.fail(job, IngestStoppedError('la ingesta se detuvo antes de procesar el audio'))
+            self.queue.task_done()
+        self.executor.shutdown()
+        for tmp_path in self.tmp_paths:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    @property
+    def pending(self):
+        return self.queue.qsize() if self.queue is not None else 0
+
+    async def submit(self, voice_bytes, wav_path, timeout=INGEST_SUBMIT_TIMEOUT):
+        """Encola un audio y devuelve su IngestJob sin esperar a que se procese.
+
+        Si la cola está llena espera hasta timeout segundos y luego lanza asyncio.QueueFull,
+        para que el handler le pida al usuario que reintente en lugar de acumular audios.
+        """
+        job = IngestJob(voice_bytes, wav_path)
+        try:
+            await asyncio.wait_for(self.queue.put(job), timeout)
+        except asyncio.TimeoutError:
+            raise asyncio.QueueFull(f'cola de ingesta llena ({self.maxsize} audios)')
+        logger.debug(f"Audio encolado para {wav_path} ({self.queue.qsize()} en cola)")
+        return job
+
+    @staticmethod
+    def fail(job, error):
+        job.error = error
+        job.voice_bytes = None
+        if not job.done.done():
+            job.done.set_result(False)
+
+    def discard(self, job):
+        """Descarta un audio: si ya se guardó se borra, si no el trabajador no lo guarda."""
+        job.discarded = True
+        job.voice_bytes = None
+        if job.done.done() and job.error is None and os.path.exists(job.wav_path):
+            os.remove(job.wav_path)
+
+    async def worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self.queue.get()
+            try:
+                await self.process(loop, job)
+            except asyncio.CancelledError:
+                # Detenido a mitad de un audio: no se guardó, así que no puede quedar como exitoso
+                job.error = IngestStoppedError('la ingesta se detuvo mientras se guardaba el audio')
+                raise
+            except Exception as e:
+                job.error = e
+                logger.error(f"No se pudo guardar {job.wav_path}: {e}")
+            finally:
+                # Los bytes ya no hacen falta; el job puede seguir referenciado desde user_data
+                if not self.keep_bytes or job.discarded or job.error is not None:
+                    job.voice_bytes = None
+                if not job.done.done():
+                    job.done.set_result(job.error is None)
+                self.queue.task_done()
+
+    async def process(self, loop, job):
+        if job.discarded:
+            return
+
+        # Se escribe en un archivo temporal propio, así un audio descartado que termina tarde
+        # nunca pisa la nueva grabación de la misma consigna
+        tmp_path = f'{job.wav_path}.{id(job)}.tmp'
+        self.tmp_paths.add(tmp_path)
+        delay = self.retry_delay
+        for intento in range(self.retries + 1):
+            try:
+                await loop.run_in_executor(self.executor, process_voice, job.voice_bytes, tmp_path)
+                break
+            except Exception as e:
+                if isinstance(e, InvalidVoiceError) or intento == self.retries:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                    self.tmp_paths.discard(tmp_path)
+                    raise
+                logger.warning(f"Error guardando {job.wav_path} (intento {intento + 1}): {e}; reintento en {delay:.0f} s")
+                await asyncio.sleep(delay)
+                delay *= 2
+        self.tmp_paths.discard(tmp_path)
+
+        if job.discarded:
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, job.wav_path)
+            logger.debug(f"Audio guardado en {job.wav_path}")
+
+def append_feature_row(store_dir, fila, recording_id, category, params):
+    """Agrega una fila al almacén columnar; devuelve False si el id ya estaba. Corre en un único hilo."""
+    import pandas as pd
+    from almacen import write_store
+    from caracteristicas import feature_columns
+
+    df = pd.DataFrame([fila], columns=feature_columns(params['stats']))
+    df.insert(0, 'id', [recording_id])
+    df['category'] = category
+    return write_store(df, store_dir, append=True) > 0
+
+class FeatureWriter:
+    """Extrae en segundo plano las características de los audios confirmados y las agrega al almacén.
+
+    Usa el mismo id de grabación y la misma caché por contenido que extraccion.py, así una corrida
+    posterior con --incremental no vuelve a procesar estos audios.
+    """
+
+    def __init__(self, store_root=None, cache_dir=None, n_workers=EXTRACTION_WORKERS):
+        from extraccion import CACHE_DIR, STORE_ROOT
+
+        self.store_root = store_root or STORE_ROOT
+        self.cache_root = cache_dir or CACHE_DIR
+        self.n_workers = n_workers
+        self.executor = None
+        self.writer = None
+        self.cache_dir = None
+        self.tasks = set()
+
+    async def start(self):
+        from caracteristicas import EXTRACTION_PARAMS
+        from extraccion import open_feature_cache
+
+        # El bot no borra las cachés de otros parámetros: puede haber una extracción corriendo con ellos
+        self.params = EXTRACTION_PARAMS
+        self.cache_dir = open_feature_cache(self.cache_root, self.params, invalidate=False)
+        self.executor = ProcessPoolExecutor(max_workers=self.n_workers)
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='almacen')
+        logger.info(f"Extracción al confirmar activada: almacén en {self.store_root}")
+
+    async def stop(self):
+        if self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.executor.shutdown()
+        self.writer.shutdown()
+
+    def submit(self, job, audio_index, category):
+        """Programa la extracción de un audio confirmado; espera a que la ingesta lo haya guardado."""
+        task = asyncio.create_task(self.extract(job, audio_index, category))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def extract(self, job, audio_index, category):
+        from extraccion import extract_row, recording_id
+
+        try:
+            if not await job.done or job.discarded:
+                return
+
+            loop = asyncio.get_running_loop()
+            store_dir = os.path.join(self.store_root, f'audio_{audio_index + 1}')
+            id_ = recording_id(os.path.dirname(job.wav_path), os.path.basename(job.wav_path))
+
+            # Si extraccion.py ya lo procesó, la caché compartida evita recalcularlo y write_store
+            # descarta el id repetido bajo el lock del almacén
+            fila = await loop.run_in_executor(self.executor, extract_row, job.wav_path, self.params, self.cache_dir)
+            if await loop.run_in_executor(self.writer, append_feature_row, store_dir, fila, id_, category, self.params):
+                logger.debug(f"Características de {job.wav_path} agregadas a {store_dir}")
+            else:
+                logger.debug(f"{job.wav_path} ya está en {store_dir}")
+        except Exception as e:
+            logger.error(f"No se pudieron extraer las características de {job.wav_path}: {e}")
+
+class ArchiveWriter:
+    """Guarda en el archivo compacto la nota de voz original (OGG/Opus) de cada audio confirmado.
+
+    Requiere una IngestQueue con keep_bytes=True. Las escrituras van a un único hilo.
+    """
+
+    def __init__(self, archive_dir):
+        self.archive_dir = archive_dir
+        self.archivo = None
+        self.writer = None
+        self.tasks = set()
+
+    async def start(self):
+        from archivo import Archivo
+
+        self.archivo = Archivo(self.archive_dir)
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='archivo')
+        logger.info(f"Archivo de audios originales en {self.archive_dir} ({len(self.archivo)} audios)")
+
+    async def stop(self):
+        if self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.writer.shutdown()
+
+    def submit(self, job, user, prompt, sex, smoker):
+        task = asyncio.create_task(self.archive(job, user, prompt, sex, smoker))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def archive(self, job, user, prompt, sex, smoker):
+        try:
+            if not await job.done or job.discarded:
+                return
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self.writer, self.archivo.add, job.voice_bytes, user, prompt, sex, smoker, 'ogg')
+            logger.debug(f"Nota de voz de {user} (consigna {prompt}) archivada")
+        except Exception as e:
+            logger.error(f"No se pudo archivar la nota de voz de {user} (consigna {prompt}): {e}")
+        finally:
+            job.voice_bytes = None
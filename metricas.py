@@ -0,0 +1,141 @@
+import time
+import logging
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Límites superiores de los buckets de latencia, en segundos
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Muestras recientes que se guardan por serie para los percentiles del resumen en el log
+RECENT_SAMPLES = 1000
+
+METRIC_NAME = 'bot_stage_latency_seconds'
+
+class Histogram:
+    """Histograma acumulado de latencias de una etapa, con las últimas muestras para percentiles."""
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+
+    def observe(self, seconds):
+        for bucket_idx, limite in enumerate(BUCKETS):
+            if seconds <= limite:
+                self.counts[bucket_idx] += 1
+                break
+        self.count += 1
+        self.sum += seconds
+        self.recent.append(seconds)
+
+class Metrics:
+    """Histogramas de latencia por etapa y por consigna. Se puede usar desde varios hilos."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+
+    def observe(self, stage, seconds, prompt=None):
+        clave = (stage, '' if prompt is None else str(prompt))
+        with self.lock:
+            if clave not in self.histograms:
+                self.histograms[clave] = Histogram()
+            self.histograms[clave].observe(seconds)
+
+    def observe_all(self, tiempos, prompt=None):
+        for stage, seconds in tiempos.items():
+            self.observe(stage, seconds, prompt)
+
+    def timer(self, stage, prompt=None):
+        return StageTimer(self, stage, prompt)
+
+    def render_prometheus(self):
+        """Histogramas en el formato de texto de Prometheus."""
+        lineas = [f'# HELP {METRIC_NAME} Latencia de cada etapa del procesamiento de un audio.',
+                  f'# TYPE {METRIC_NAME} histogram']
+        with self.lock:
+            for (stage, prompt), histograma in sorted(self.histograms.items()):
+                etiquetas = f'stage="{stage}",prompt="{prompt}"'
+                acumulado = 0
+                for limite, cantidad in zip(BUCKETS, histograma.counts):
+                    acumulado += cantidad
+                    lineas.append(f'{METRIC_NAME}_bucket{{{etiquetas},le="{limite}"}} {acumulado}')
+                lineas.append(f'{METRIC_NAME}_bucket{{{etiquetas},le="+Inf"}} {histograma.count}')
+                lineas.append(f'{METRIC_NAME}_sum{{{etiquetas}}} {histograma.sum}')
+                lineas.append(f'{METRIC_NAME}_count{{{etiquetas}}} {histograma.count}')
+        return '\n'.join(lineas) + '\n'
+
+    def summary(self):
+        """Una línea por etapa (todas las consignas juntas) con cantidad, media y percentiles recientes."""
+        por_etapa = {}
+        with self.lock:
+            for (stage, _), histograma in self.histograms.items():
+                total = por_etapa.setdefault(stage, [0, 0.0, []])
+                total[0] += histograma.count
+                total[1] += histograma.sum
+                total[2].extend(histograma.recent)
+
+        lineas = []
+        for stage, (count, suma, recientes) in sorted(por_etapa.items()):
+            recientes = sorted(recientes)
+            p50 = recientes[len(recientes) // 2]
+            p95 = recientes[min(len(recientes) - 1, int(len(recientes) * 0.95))]
+            lineas.append(f'{stage}: n={count} media={suma / count * 1000:.0f} ms '
+                          f'p50={p50 * 1000:.0f} ms p95={p95 * 1000:.0f} ms')
+        return lineas
+
+class StageTimer:
+    """Context manager que registra la duración del bloque en una etapa."""
+
+    def __init__(self, metrics, stage, prompt=None):
+        self.metrics = metrics
+        self.stage = stage
+        self.prompt = prompt
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.stage, time.perf_counter() - self.inicio, self.prompt)
+        return False
+
+def start_http_server(metrics, port, host='127.0.0.1'):
+    """Sirve /metrics en formato Prometheus desde un hilo aparte. Devuelve el servidor."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != '/metrics':
+                self.send_error(404)
+                return
+            cuerpo = metrics.render_prometheus().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(cuerpo)))
+            self.end_headers()
+            self.wfile.write(cuerpo)
+
+        def log_message(self, format, *args):
+            # Las consultas periódicas del scraper no van al log del bot
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name='metricas-http', daemon=True).start()
+    logger.info(f"Métricas disponibles en http://{host}:{port}/metrics")
+    return server
+
+def start_log_summary(metrics, interval):
+    """Escribe en el log el resumen de latencias cada interval segundos, desde un hilo aparte."""
+    detener = threading.Event()
+
+    def loop():
+        while not detener.wait(interval):
+            for linea in metrics.summary():
+                logger.info(f"Latencia {linea}")
+
+    threading.Thread(target=loop, name='metricas-log', daemon=True).start()
+    return detener
@@ -1,11 +1,14 @@
 import os
 import asyncio
 import logging
-from pydub import AudioSegment
 from telegram.request import HTTPXRequest
 from telegram import ForceReply, Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, ReplyKeyboardRemove
 from telegram.ext import Application, CommandHandler, ContextTypes, MessageHandler, filters, ConversationHandler, CallbackQueryHandler
 
+from ingesta import ArchiveWriter, FeatureWriter, IngestQueue
+from registro import Registro
+from concurrencia import PerChatUpdateProcessor
+
 # Leer el token desde el archivo token.txt
 with open('token_recoppilacion.txt', 'r') as file:
     TOKEN = file.read().strip()
@@ -17,13 +20,27 @@ logger = logging.getLogger(__name__)
 # Define conversation states
 ASK_USERNAME, ASK_SEX, ASK_AGE, ASK_SMOKER, ASK_CIGARETTES_PER_DAY, ASK_YEARS_SMOKING, ASK_VOICE, ASK_CONFIRM, ASK_RATING, ASK_FEEDBACK, ASK_FEEDBACK_MESSAGE = range(11)
 
-# File to store user names
+# Base de datos de participantes y archivo de texto anterior, que se importa al crear la base
+DB_FILE = "participantes.db"
 USER_FILE = "nombres.txt"
 
-# Verificar y crear "nombres.txt" si no existe
-if not os.path.exists(USER_FILE):
-    with open(USER_FILE, 'w') as file:
-        file.write("")
+# Registro de participantes (se abre en main)
+registro = None
+
+# Con ARCHIVAR_AUDIOS=1 la nota de voz original de cada audio confirmado se guarda en el archivo compacto
+ARCHIVE_ON_CONFIRM = os.environ.get('ARCHIVAR_AUDIOS', '0') == '1'
+ARCHIVE_DIR = "archivo_audios"
+archive_writer = ArchiveWriter(ARCHIVE_DIR) if ARCHIVE_ON_CONFIRM else None
+
+# Cola donde los handlers dejan las notas de voz para que se guarden en segundo plano
+ingest_queue = IngestQueue(keep_bytes=ARCHIVE_ON_CONFIRM)
+
+# Segundos que espera "Confirmar" a que la ingesta termine de guardar el audio
+CONFIRM_TIMEOUT = 30.0
+
+# Con EXTRAER_CARACTERISTICAS=1 cada audio confirmado se agrega al almacén de características
+EXTRACT_ON_CONFIRM = os.environ.get('EXTRAER_CARACTERISTICAS', '0') == '1'
+feature_writer = FeatureWriter() if EXTRACT_ON_CONFIRM else None
 
 # Audio instructions
 audio_instructions = [
@@ -42,6 +59,10 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Send a message when the command /start is issued."""
     logger.debug("Start command issued")
+    # Una encuesta nueva no hereda el nombre de la anterior (por ejemplo, otra persona tras /aqui)
+    release_username(context.user_data)
+    context.user_data.pop('registered', None)
+
     await update.message.reply_html(rf"""¡Hola! Te doy la bienvenida a este bot de recopilación de audios para un proyecto sobre el efecto del cigarrillo en la voz.""")
     await asyncio.sleep(4)
     
@@ -83,11 +104,13 @@ async def ask_username(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
         await update.message.reply_text("El nombre de usuario no puede estar vacío. Por favor, ingresa un nombre de usuario:")
         return ASK_USERNAME
 
-    if is_username_taken(user_name):
+    # Reservar el nombre evita que otra conversación en curso elija el mismo y pise sus audios
+    if not registro.reserve_username(user_name):
         await update.message.reply_text("Este nombre ya fue utilizado. Por favor, ingresa uno nuevo:")
         return ASK_USERNAME
 
     context.user_data['user_name'] = user_name
+    context.user_data['reserved'] = True
     await update.message.reply_text(f"Excelente {user_name}, hemos registrado tu nombre. Continuemos.")
 
     keyboard = [
@@ -100,19 +123,20 @@ async def ask_username(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
     await update.message.reply_text("Elige una opción:", reply_markup=reply_markup)
     return ASK_SEX
 
-def is_username_taken(user_name: str) -> bool:
-    """Check if the user name is already taken."""
-    logger.debug(f"Checking if username '{user_name}' is taken")
-    if os.path.exists(USER_FILE):
-        with open(USER_FILE, 'r') as file:
-            return any(line.split()[0] == user_name for line in file if line.split())
-    return False
+def release_username(user_data: dict) -> None:
+    """Release the user name reserved by this conversation if it was never registered."""
+    if user_data.pop('reserved', False):
+        registro.release_username(user_data['user_name'])
 
 def save_user_data(user_data: dict) -> None:
-    """Save the user data to the file."""
+    """Save the user data to the registry."""
     logger.debug(f"Saving user data: {user_data}")
-    with open(USER_FILE, 'a') as file:
-        file.write(f"{user_data['user_name']}    {user_data['sex']}    {user_data['age']}    {user_data['smoker']}    {user_data['cigarettes_per_day']}    {user_data['years_smoking']}\n")
+    if registro.add_participant(user_data):
+        # Solo esta conversación puede borrar el registro al cancelar; el nombre ya no está reservado
+        user_data['registered'] = True
+        user_data.pop('reserved', None)
+    else:
+        logger.warning(f"El nombre '{user_data['user_name']}' fue registrado por otra conversación")
 
 async def ask_sex(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Ask for the user's sex."""
@@ -197,7 +221,7 @@ async def ask_smoker(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         
 		save_user_data(context.user_data)
 		context.user_data['audio_index'] = 0
-		context.user_data['audio_files'] = []
+		context.user_data['audio_jobs'] = []
 		await query.message.reply_text(audio_instructions[context.user_data['audio_index']])
 
 		return ASK_VOICE
@@ -257,7 +281,7 @@ async def ask_years_smoking(update: Update, context: ContextTypes.DEFAULT_TYPE)
     await asyncio.sleep(2)
     
     context.user_data['audio_index'] = 0
-    context.user_data['audio_files'] = []
+    context.user_data['audio_jobs'] = []
     await update.message.reply_text(audio_instructions[context.user_data['audio_index']])
     return ASK_VOICE
 
@@ -275,7 +299,7 @@ async def ask_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
     return ASK_CONFIRM
 
 async def download_voice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Download the voice message."""
+    """Download the voice message and queue it to be decoded and saved in the background."""
     logger.debug("download_voice called")
     user_name = context.user_data['user_name']
     audio_index = context.user_data['audio_index']
@@ -296,24 +320,18 @@ async def download_voice(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     subfolder = f'audio_{audio_index + 1}'
     
     full_folder_path = os.path.join(folder, subfolder)
-    if not os.path.exists(full_folder_path):
-        os.makedirs(full_folder_path)
 
     # Save the file in the correct folder
     file_id = context.user_data['file_id']
     new_file = await context.bot.get_file(file_id)
-    ogg_path = os.path.join(full_folder_path, f"{user_name}.ogg")
     wav_path = os.path.join(full_folder_path, f"{user_name}.wav")
 
-    await new_file.download_to_drive(ogg_path)
+    # Only the download happens here; decoding, validation and the WAV are handled by the ingest workers
+    voice_bytes = bytes(await new_file.download_as_bytearray())
+    job = await ingest_queue.submit(voice_bytes, wav_path)
 
-    # Convert the file to WAV format and save it in the same folder
-    audio = AudioSegment.from_ogg(ogg_path)
-    audio.export(wav_path, format="wav")
-    os.remove(ogg_path)
-
-    context.user_data['audio_files'].append(wav_path)
-    logger.debug(f"Downloaded and converted {ogg_path} to {wav_path}")
+    context.user_data['audio_jobs'].append(job)
+    logger.debug(f"Queued voice note for {wav_path} ({ingest_queue.pending} pending)")
 
 async def ask_voice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handle the voice message and ask for confirmation."""
@@ -332,6 +350,11 @@ async def ask_voice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         await asyncio.sleep(2)
         
         return await ask_confirm(update, context)
+
+    except asyncio.QueueFull:
+        logger.warning("Ingest queue full, asking the user to resend")
+        await update.message.reply_text("Estamos recibiendo muchos audios en este momento. Por favor, espera unos segundos y vuelve a enviarlo.")
+        return ASK_VOICE
         
     except Exception as e:
         logger.error(f"Error downloading or converting audio: {e}")
@@ -344,6 +367,27 @@ async def confirm_audio(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     query = update.callback_query
     await query.answer()
     if query.data == 'confirmar':
+        # Only advance once the background worker has saved the audio; if it rejected it, ask for it again
+        job = context.user_data['audio_jobs'][-1]
+        if not job.done.done():
+            await query.message.reply_text("Procesando el audio, un momento...")
+            try:
+                await asyncio.wait_for(asyncio.shield(job.done), CONFIRM_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.warning(f"{job.wav_path} not saved after {CONFIRM_TIMEOUT:.0f} s, asking the user to resend")
+
+        if not job.done.done() or job.failed:
+            ingest_queue.discard(context.user_data['audio_jobs'].pop())
+            await query.message.reply_text("No pudimos procesar ese audio. Por favor, grábalo y envíalo nuevamente:")
+            return ASK_VOICE
+
+        if feature_writer is not None:
+            category = 1 if context.user_data['sex'] == 'hombre' else 0
+            feature_writer.submit(job, context.user_data['audio_index'], category)
+        if archive_writer is not None:
+            archive_writer.submit(job, context.user_data['user_name'], context.user_data['audio_index'] + 1,
+                                  context.user_data['sex'], context.user_data['smoker'])
+
         audio_index = context.user_data['audio_index'] + 1
         context.user_data['audio_index'] = audio_index
         
@@ -374,7 +418,7 @@ async def confirm_audio(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
             await query.message.reply_text("¿Deseas calificar tu experiencia de uso de este bot?", reply_markup=reply_markup)
             return ASK_RATING
     else:
-        os.remove(context.user_data['audio_files'].pop())
+        ingest_queue.discard(context.user_data['audio_jobs'].pop())
         await query.message.reply_text("Audio desechado. Por favor, graba nuevamente:")
         return ASK_VOICE
 
@@ -436,13 +480,9 @@ async def ask_feedback_message(update: Update, context: ContextTypes.DEFAULT_TYP
         context.user_data['feedback_message'] = " "
         return await save_feedback_message(update, context)
 
+# Archivo de calificaciones anterior, que se importa a la base al crearla
 feedback_file = "calificaciones.txt"
 
-# Verificar y crear "calificaciones.txt" si no existe
-if not os.path.exists(feedback_file):
-    with open(feedback_file, 'w') as file:
-        file.write("")
-
 async def save_feedback_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Save feedback message and end the conversation."""
     logger.debug("save_feedback_message called")
@@ -451,30 +491,10 @@ async def save_feedback_message(update: Update, context: ContextTypes.DEFAULT_TY
 
     user_data = context.user_data
     user_name = user_data.get('user_name', 'Unknown')  # Suponiendo que tienes el ID o nombre del usuario
-    rating = user_data.get('rating', 'N/A')
-
-    # Actualizar o agregar la línea correspondiente en el archivo nombres.txt
-    feedback_lines = []
-    user_found = False
-
-    # Leer el archivo y actualizar la línea correspondiente al usuario
-    if os.path.exists(feedback_file):
-        with open(feedback_file, "r") as file:
-            feedback_lines = file.readlines()
+    rating = user_data.get('rating')
 
-        for i, line in enumerate(feedback_lines):
-            if line.startswith(f"Usuario: {user_name},"):
-                feedback_lines[i] = f"{user_name}    {rating}    {feedback_message}\n"
-                user_found = True
-                break
-
-    # Si el usuario no se encontró, agregar una nueva línea
-    if not user_found:
-        feedback_lines.append(f"{user_name}    {rating}    {feedback_message}\n")
-
-    # Guardar el archivo actualizado
-    with open(feedback_file, "w") as file:
-        file.writelines(feedback_lines)
+    # Actualizar o agregar la calificación del usuario
+    registro.save_feedback(user_name, rating, feedback_message)
 
     # Determinar el tipo de actualización y responder adecuadamente
     if update.message:
@@ -493,27 +513,39 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Cancel the conversation."""
     logger.debug("Conversation canceled by user")
     user_data = context.user_data
-    user_name = user_data.get('user_name', 'NoName')
-    
-    lines_to_keep = []
-    
-    if os.path.exists(USER_FILE):
-        with open(USER_FILE, 'r') as file:
-            lines = file.readlines()
-            
-        lines_to_keep = [line for line in lines if not line.startswith(user_name)]
-        
-        with open(USER_FILE, 'w') as file:
-            file.writelines(lines_to_keep)
+
+    # Se borra exactamente el participante que registró esta conversación, si llegó a registrarse
+    if user_data.pop('registered', False):
+        registro.remove_participant(user_data['user_name'])
+    release_username(user_data)
             
     await update.message.reply_text("Encuesta cancelada.")
     await asyncio.sleep(1)
     await update.message.reply_text("Si deseas comenzar de nuevo, haz click /aqui.")
     return ConversationHandler.END
 
+async def start_ingest(application: Application) -> None:
+    await ingest_queue.start()
+    if feature_writer is not None:
+        await feature_writer.start()
+    if archive_writer is not None:
+        await archive_writer.start()
+
+async def stop_ingest(application: Application) -> None:
+    await ingest_queue.stop()
+    if feature_writer is not None:
+        await feature_writer.stop()
+    if archive_writer is not None:
+        await archive_writer.stop()
+
 def main() -> None:
+    global registro
+    registro = Registro(DB_FILE, legacy_users_file=USER_FILE, legacy_feedback_file=feedback_file)
     
-    application = Application.builder().token(TOKEN).build()
+    # Updates from different chats are handled concurrently and those of the same chat in order;
+    # the ingest workers live in the bot's event loop
+    application = (Application.builder().token(TOKEN).concurrent_updates(PerChatUpdateProcessor())
+                   .post_init(start_ingest).post_shutdown(stop_ingest).build())
 
     # Add conversation handler with the states ASK_USERNAME, ASK_SEX, ASK_AGE, ASK_SMOKER, ASK_CIGARETTES_PER_WEEK, ASK_YEARS_SMOKING, ASK_VOICE, ASK_CONFIRM
     conv_handler = ConversationHandler(
@@ -0,0 +1,139 @@
+import os
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Columnas de cada participante, en el orden en que se escribían en nombres.txt
+PARTICIPANT_FIELDS = ('user_name', 'sex', 'age', 'smoker', 'cigarettes_per_day', 'years_smoking')
+
+# Separador de los archivos de texto anteriores
+TXT_SEPARATOR = '    '
+
+class Registro:
+    """Registro de participantes y calificaciones en SQLite, con los nombres en memoria para consultarlos en O(1).
+
+    La base se abre una sola vez al iniciar el bot. Todas las escrituras pasan por un lock y
+    se hacen en una transacción, así varias conversaciones a la vez no pueden pisarse.
+    """
+
+    def __init__(self, db_path, legacy_users_file=None, legacy_feedback_file=None):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+
+        # Cada archivo de texto anterior se importa una sola vez, cuando se crea su tabla
+        nueva_participantes = not self.table_exists('participantes')
+        nueva_calificaciones = not self.table_exists('calificaciones')
+        with self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS participantes (
+                    user_name TEXT PRIMARY KEY,
+                    sex TEXT,
+                    age INTEGER,
+                    smoker TEXT,
+                    cigarettes_per_day INTEGER,
+                    years_smoking INTEGER,
+                    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+                )""")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS calificaciones (
+                    user_name TEXT PRIMARY KEY,
+                    rating INTEGER,
+                    message TEXT,
+                    updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+                )""")
+
+        if nueva_participantes and legacy_users_file and os.path.exists(legacy_users_file):
+            self.migrate_users_txt(legacy_users_file)
+        if nueva_calificaciones and legacy_feedback_file and os.path.exists(legacy_feedback_file):
+            self.migrate_feedback_txt(legacy_feedback_file)
+
+        self.user_names = {fila[0] for fila in self.conn.execute('SELECT user_name FROM participantes')}
+
+        # Nombres elegidos en conversaciones en curso que todavía no terminaron de registrarse
+        self.reserved = set()
+        logger.info(f"Registro abierto: {len(self.user_names)} participantes en {db_path}")
+
+    def table_exists(self, table):
+        return self.conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone() is not None
+
+    def migrate_users_txt(self, path):
+        """Importa los participantes de nombres.txt (una vez, al crear la tabla)."""
+        filas = []
+        with open(path, 'r') as file:
+            for line in file:
+                campos = line.rstrip('\n').split(TXT_SEPARATOR)
+                if campos and campos[0].strip():
+                    campos = (campos + [None] * len(PARTICIPANT_FIELDS))[:len(PARTICIPANT_FIELDS)]
+                    filas.append(campos)
+
+        with self.lock, self.conn:
+            self.conn.executemany(f"INSERT OR IGNORE INTO participantes ({', '.join(PARTICIPANT_FIELDS)}) "
+                                  f"VALUES ({', '.join('?' * len(PARTICIPANT_FIELDS))})", filas)
+        logger.info(f"{len(filas)} participantes importados desde {path}")
+
+    def migrate_feedback_txt(self, path):
+        """Importa calificaciones.txt (una vez, al crear la tabla); si un usuario aparece varias veces queda la última."""
+        cantidad = 0
+        with open(path, 'r') as file:
+            for line in file:
+                campos = line.rstrip('\n').split(TXT_SEPARATOR, 2)
+                if len(campos) == 3 and campos[0].strip():
+                    user_name, rating, message = campos
+                    self.save_feedback(user_name, None if rating == 'N/A' else rating, message)
+                    cantidad += 1
+        logger.info(f"{cantidad} calificaciones importadas desde {path}")
+
+    def save_feedback(self, user_name, rating, message):
+        """Guarda o reemplaza la calificación y el mensaje de un usuario."""
+        with self.lock, self.conn:
+            self.conn.execute("""
+                INSERT INTO calificaciones (user_name, rating, message) VALUES (?, ?, ?)
+                ON CONFLICT (user_name) DO UPDATE SET
+                    rating = excluded.rating,
+                    message = excluded.message,
+                    updated_at = CURRENT_TIMESTAMP""", (user_name, rating, message))
+
+    def is_username_taken(self, user_name):
+        return user_name in self.user_names or user_name in self.reserved
+
+    def reserve_username(self, user_name):
+        """Reserva un nombre libre para una conversación. Devuelve False si ya está registrado o reservado."""
+        with self.lock:
+            if self.is_username_taken(user_name):
+                return False
+            self.reserved.add(user_name)
+        return True
+
+    def release_username(self, user_name):
+        """Libera un nombre reservado que no llegó a registrarse."""
+        with self.lock:
+            self.reserved.discard(user_name)
+
+    def add_participant(self, user_data):
+        """Guarda un participante. Devuelve False si el nombre ya estaba registrado."""
+        valores = [user_data[campo] for campo in PARTICIPANT_FIELDS]
+        with self.lock:
+            try:
+                with self.conn:
+                    self.conn.execute(f"INSERT INTO participantes ({', '.join(PARTICIPANT_FIELDS)}) "
+                                      f"VALUES ({', '.join('?' * len(PARTICIPANT_FIELDS))})", valores)
+            except sqlite3.IntegrityError:
+                return False
+            self.user_names.add(user_data['user_name'])
+            self.reserved.discard(user_data['user_name'])
+        return True
+
+    def remove_participant(self, user_name):
+        """Borra exactamente ese participante (no los que empiezan igual). Devuelve si existía."""
+        with self.lock:
+            with self.conn:
+                borradas = self.conn.execute('DELETE FROM participantes WHERE user_name = ?', (user_name,)).rowcount
+            self.user_names.discard(user_name)
+        return borradas > 0
+
+    def close(self):
+        with self.lock:
+            self.conn.close()